@@ -1,22 +1,30 @@
 import asyncio
 import atexit
+import json
 import os
 import platform
 import subprocess
 import sys
+import threading
+import time
 import urllib.request
 from aiohttp import web
 from configobj import ConfigObj, get_extra_values, flatten_errors
-from gamma import Context, generate_ramp
+from gamma import (Calibration, CalibrationCache, Context, ContextError,
+                   RampAtlas, RampCache, Worker)
+from gsi import SessionRecorder, parse_state, select_state
+from metrics import Metrics
 from validate import is_boolean, Validator
 
 
-def extract(data, *keys, default=None):
-    for key in keys:
-        if not isinstance(data, dict) or key not in data:
-            return default
-        data = data[key]
-    return data
+# Seconds a temperature has to stay in use before its ramp atlas is built.
+ATLAS_DELAY = 10.0
+
+
+def flash_contrast(flashed, smoked):
+    flashed = flashed / 255
+    smoked = smoked / 255
+    return (0.25 + 0.75 * (1 - smoked)) * (1 - flashed) / (1 + flashed)
 
 
 def resource_path(filename=None):
@@ -32,7 +40,7 @@ def resource_path(filename=None):
 
 
 class App:
-    def __init__(self, path=None):
+    def __init__(self, path=None, context=None):
         if path is None:
             path = os.getcwd()
 
@@ -99,6 +107,15 @@ class App:
         self.host = settings['Game State Integration']['host']
         self.port = settings['Game State Integration'].as_int('port')
 
+        if settings['Game State Integration']['record_sessions']:
+            sessions_path = os.path.join(path, 'sessions')
+            os.makedirs(sessions_path, exist_ok=True)
+            self.recorder = SessionRecorder(
+                os.path.join(sessions_path, time.strftime(
+                    'gsi-%Y%m%d-%H%M%S.bin')), compress=True)
+        else:
+            self.recorder = None
+
         gamestate_integration_cfg_template_path = os.path.join(
             res_path, 'gamestate_integration_dont_blind_me.cfg.template')
 
@@ -123,11 +140,74 @@ class App:
         self.player_alive = None
         self.player_flashed = [None, 0]
         self.player_smoked = [None, 0]
-
-        self.context = Context.open()
+        self.provider_timestamp = None
+        self.trace = None
+        self.full_decodes = 0
+        self.short_circuited = 0
+        self._last_body = None
+        self._last_state = None
+
+        # exists while the app may have changed the screen; if it is left
+        # over, the last run did not restore the screen and the ramp on it
+        # cannot be trusted as snapshot
+        self.dirty_path = os.path.join(path, 'gamma.dirty')
+
+        if context is None:
+            calibration_cache = CalibrationCache(
+                os.path.join(path, 'calibration.bin'))
+
+            # DONT_BLIND_ME_CONTEXT selects a backend by name, e.g. 'null'
+            # to run without a display
+            context = Context.open(
+                backend=os.environ.get('DONT_BLIND_ME_CONTEXT'),
+                calibration_cache=calibration_cache,
+                use_snapshot=not os.path.exists(self.dirty_path))
+
+        open(self.dirty_path, mode='w').close()
+
+        self.context = context
+        self.ramp_cache = RampCache(ramp_ctype=self.context.ramp_ctype)
+        self.atlas = None
+        self.calibration = None
+        self._calibration_ramp = None
+        self._built_atlas = None
+        self._atlas_key = None
+        self._atlas_since = None
+        self._atlas_requested = False
+        self._atlas_lock = threading.Lock()
+        self.atlas_worker = Worker(self.build_atlas, name='atlas')
+        self.worker = Worker(self.apply_brightness, name='gamma')
+
+        metrics = Metrics()
+        metrics.counter('requests', 'GSI requests handled',
+                        lambda: metrics.requests)
+        metrics.counter('updates', 'Brightness updates applied',
+                        lambda: self.worker.processed)
+        metrics.counter('coalesced_updates', 'Brightness updates replaced '
+                        'by a newer one before being applied',
+                        lambda: self.worker.coalesced)
+        metrics.counter('submissions', 'Gamma ramps submitted to the driver',
+                        lambda: self.context.submissions)
+        metrics.counter('skipped_submissions', 'Gamma ramps skipped because '
+                        'they were already on screen',
+                        lambda: self.context.skipped_submissions)
+        metrics.counter('full_decodes', 'GSI payloads that had to be '
+                        'decoded in full', lambda: self.full_decodes)
+        metrics.counter('short_circuited_requests', 'GSI payloads ignored '
+                        'because nothing the app uses had changed',
+                        lambda: self.short_circuited)
+        metrics.counter('driver_errors', 'Failed driver submissions',
+                        lambda: metrics.driver_errors)
+        metrics.counter('driver_retries', 'Retried driver calls',
+                        lambda: self.context.retries)
+        self.metrics = metrics
 
     async def handle(self, request):
+        self.metrics.requests += 1
+
         if request.method == 'GET':
+            self.trace = None
+
             if not self.ignore_temperature:
                 ct = request.query.get('ct')
 
@@ -149,24 +229,74 @@ class App:
 
                 self.temperature[1] = ct
         else:
-            data = await request.json()
+            received = time.perf_counter()
+            received_wall = time.time()
 
-            provider_id = extract(data, 'provider', 'steamid')
-            round_phase = extract(data, 'round', 'phase')
-            player_id = extract(data, 'player', 'steamid')
-            player_flashed = extract(data, 'player', 'state', 'flashed',
-                                     default=0)
-            player_smoked = extract(data, 'player', 'state', 'smoked',
-                                    default=0)
+            if not self.handle_state(await request.read(), request.charset):
+                return web.Response()
 
-            self.round_phase[1] = round_phase
-            self.player_alive = player_id == provider_id
-            self.player_flashed[1] = player_flashed
-            self.player_smoked[1] = player_smoked
+            self.trace = (self.provider_timestamp, received_wall, received)
 
+        t = time.perf_counter()
         self.update_brightness()
+        self.metrics.diff.observe(time.perf_counter() - t)
+
         return web.Response()
 
+    async def handle_metrics(self, request):
+        return web.Response(body=self.metrics.expose().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; '
+                                     'version=0.0.4; charset=utf-8'})
+
+    # Returns False, without touching the game state, if the payload cannot
+    # change the screen: either it is the previous body again or it differs
+    # from it only in values the app does not use, such as the provider
+    # timestamp of a heartbeat.
+    def handle_state(self, body, charset=None):
+        if self.recorder is not None:
+            self.recorder.record(body)
+
+        if body == self._last_body:
+            self.short_circuited += 1
+            return False
+
+        t = time.perf_counter()
+
+        if charset in (None, 'utf-8'):
+            state = select_state(body)
+        else:
+            state = None
+
+        if state is None:
+            self.full_decodes += 1
+            state = parse_state(json.loads(body.decode(charset or 'utf-8')))
+
+        self.metrics.decode.observe(time.perf_counter() - t)
+        self._last_body = body
+
+        (provider_id, provider_timestamp, round_phase, player_id,
+         player_flashed, player_smoked) = state
+
+        relevant = (provider_id, round_phase, player_id, player_flashed,
+                    player_smoked)
+
+        if relevant == self._last_state:
+            self.short_circuited += 1
+            return False
+
+        self._last_state = relevant
+
+        if not isinstance(provider_timestamp, (int, float)):
+            provider_timestamp = None
+
+        self.provider_timestamp = provider_timestamp
+        self.round_phase[1] = round_phase
+        self.player_alive = player_id == provider_id
+        self.player_flashed[1] = player_flashed
+        self.player_smoked[1] = player_smoked
+
+        return True
+
     def update_brightness(self, force=False):
         update = force
 
@@ -190,50 +320,247 @@ class App:
         if not update:
             return
 
-        if self.round_phase[0] is not None:
-            if self.mat_monitorgamma_tv_enabled:
-                gamma = self.mat_monitorgamma / 2.5
-                minimum = 16 / 255
-                maximum = 235 / 255
-            else:
-                gamma = self.mat_monitorgamma / 2.2
-                minimum = 0.0
-                maximum = 1.0
+        if self.black_flash:
+            flashed = self.player_flashed[0]
+        else:
+            flashed = 0
+
+        if self.black_smoke:
+            smoked = self.player_smoked[0]
+        else:
+            smoked = 0
+
+        self.worker.post((self.round_phase[0], flashed, smoked,
+                          self.temperature[0], self.trace))
+
+    # Runs on the worker thread, which is the only thread that touches the
+    # context, the current atlas and the ramp cache while the app is
+    # running.
+    def apply_brightness(self, state):
+        round_phase, flashed, smoked, temperature, trace = state
+
+        t = time.perf_counter()
+
+        self.update_calibration()
+
+        if round_phase is not None:
+            atlas = self.current_atlas(temperature)
+            index = self.atlas_index(flashed, smoked)
+
+            if atlas is not None and index is not None:
+                ramp = atlas[index]
+                self.metrics.generate.observe(time.perf_counter() - t)
+                self.submit_ramp(ramp, trace)
+                return
+
+            gamma, minimum, maximum = self.video_settings()
         else:
             gamma = 1.0
             minimum = 0.0
             maximum = 1.0
 
-        if self.black_flash:
-            flashed = self.player_flashed[0] / 255
+        contrast = flash_contrast(flashed, smoked)
+
+        ramp = self.ramp_cache.generate_ramp(size=self.context.ramp_size,
+                                             gamma=gamma, contrast=contrast,
+                                             minimum=minimum, maximum=maximum,
+                                             temperature=temperature)
+
+        self.metrics.generate.observe(time.perf_counter() - t)
+        self.submit_ramp(ramp, trace)
+
+    # Context.set_ramp split into its two halves so that packing and the
+    # driver call are timed separately. The trace of the GSI update, if the
+    # ramp comes from one, is completed once the ramp is on screen.
+    def submit_ramp(self, ramp, trace=None):
+        metrics = self.metrics
+
+        t = time.perf_counter()
+        changed = self.context.prepare_ramp(ramp)
+        metrics.pack.observe(time.perf_counter() - t)
+
+        if not changed:
+            return
+
+        t = time.perf_counter()
+
+        try:
+            self.context.commit()
+        except ContextError:
+            metrics.driver_errors += 1
+            raise
+
+        committed = time.perf_counter()
+        metrics.submit.observe(committed - t)
+
+        if trace is not None:
+            metrics.tracer.record(trace, committed)
+
+    # The context hands out the same ramp object until the display profile
+    # changes, so the identity check keeps this free on the hot path.
+    def update_calibration(self):
+        ramp = self.context.get_calibration_ramp()
+
+        if ramp is self._calibration_ramp:
+            return
+
+        self._calibration_ramp = ramp
+
+        if ramp is not None:
+            self.calibration = Calibration(ramp)
         else:
-            flashed = 0
+            self.calibration = None
+
+        self.ramp_cache.set_calibration(self.calibration)
+
+        if (self.atlas is not None and
+                self.atlas.calibration != self.calibration):
+            self.atlas.close()
+            self.atlas = None
+
+    def video_settings(self):
+        if self.mat_monitorgamma_tv_enabled:
+            return self.mat_monitorgamma / 2.5, 16 / 255, 235 / 255
+        else:
+            return self.mat_monitorgamma / 2.2, 0.0, 1.0
+
+    def atlas_index(self, flashed, smoked):
+        if not isinstance(flashed, int) or not isinstance(smoked, int):
+            return None
+
+        if smoked == 0 and 0 <= flashed <= 255:
+            return flashed
+
+        if flashed == 0 and 0 < smoked <= 255:
+            return 255 + smoked
+
+        return None
+
+    # Returns the atlas for temperature, or None while there is none and the
+    # ramp cache has to serve. An atlas is only requested from the atlas
+    # worker once temperature has been in use for ATLAS_DELAY seconds, so
+    # that gradual temperature transitions do not build one per step.
+    def current_atlas(self, temperature):
+        with self._atlas_lock:
+            built = self._built_atlas
+            self._built_atlas = None
+
+        if built is not None:
+            if self.atlas is not None:
+                self.atlas.close()
+
+            self.atlas = built
+
+        key = (temperature, self.calibration)
+        atlas = self.atlas
+
+        if atlas is not None and (atlas.temperature,
+                                  atlas.calibration) == key:
+            return atlas
+
+        now = time.monotonic()
+
+        if key != self._atlas_key:
+            self._atlas_key = key
+            self._atlas_since = now
+            self._atlas_requested = False
+        elif (not self._atlas_requested and
+                now - self._atlas_since >= ATLAS_DELAY):
+            self._atlas_requested = True
+            self.atlas_worker.post(key)
+
+        return None
+
+    # Runs on the atlas worker.
+    def build_atlas(self, key):
+        temperature, calibration = key
+        gamma, minimum, maximum = self.video_settings()
+
+        contrasts = [flash_contrast(flashed, 0) for flashed in range(256)]
 
         if self.black_smoke:
-            smoked = self.player_smoked[0] / 255
+            contrasts += [flash_contrast(0, smoked)
+                          for smoked in range(1, 256)]
+
+        atlas = RampAtlas(os.path.join(self.path, 'cache'), contrasts,
+                          size=self.context.ramp_size, gamma=gamma,
+                          temperature=temperature, minimum=minimum,
+                          maximum=maximum,
+                          ramp_ctype=self.context.ramp_ctype,
+                          calibration=calibration)
+
+        if atlas.build_time is not None:
+            action = 'built in {:.1f} ms'.format(atlas.build_time * 1e3)
         else:
-            smoked = 0
+            action = 'loaded in {:.1f} ms'.format(atlas.load_time * 1e3)
+
+        print('Ramp atlas: {} ramps, {:.1f} KiB, {}'.format(
+              len(atlas), atlas.file_size / 1024, action))
 
-        contrast = (0.25 + 0.75 * (1 - smoked)) * (1 - flashed) / (1 + flashed)
+        with self._atlas_lock:
+            if self._built_atlas is not None:
+                self._built_atlas.close()
 
-        ramp = generate_ramp(size=self.context.ramp_size, gamma=gamma,
-                             contrast=contrast, minimum=minimum,
-                             maximum=maximum, temperature=self.temperature[0])
+            self._built_atlas = atlas
 
-        self.context.set_ramp(ramp)
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/', self.handle)
+        app.router.add_post('/', self.handle)
+        app.router.add_get('/metrics', self.handle_metrics)
+        return app
 
     def run(self):
         self.update_brightness(force=True)
 
-        self.app = web.Application()
-        self.app.router.add_get('/', self.handle)
-        self.app.router.add_post('/', self.handle)
+        self.app = self.make_app()
 
         web.run_app(self.app, host=self.host, port=self.port)
 
     def close(self):
+        self.worker.close()
+        self.atlas_worker.close()
+
+        if self.recorder is not None:
+            self.recorder.close()
+            print('GSI session: {} updates recorded into {}'.format(
+                  self.recorder.frames, self.recorder.path))
+
+        for atlas in (self.atlas, self._built_atlas):
+            if atlas is not None:
+                atlas.close()
+
+        print('GSI requests: {} handled, {} short-circuited as '
+              'unchanged'.format(self.metrics.requests,
+                                 self.short_circuited))
+        print('Gamma ramp submissions: {} issued, {} skipped as '
+              'unchanged'.format(self.context.submissions,
+                                 self.context.skipped_submissions))
+        print('Gamma ramp commit skew between outputs: at most {:.1f} '
+              'us'.format(self.context.max_commit_skew * 1e6))
+
+        tracer = self.metrics.tracer
+
+        if tracer.traced:
+            latencies, ages = tracer.percentiles()
+
+            print('GSI update to screen: {} ({} outliers)'.format(
+                  ', '.join('p{:g} {:.2f} ms'.format(q * 100, v * 1e3)
+                            for q, v in latencies), tracer.outliers))
+            print('Game to screen by provider.timestamp: {}'.format(
+                  ', '.join('p{:g} {:.1f} s'.format(q * 100, v)
+                            for q, v in ages)))
+
+        t = time.perf_counter()
+
         self.context.close()
 
+        print('Screen restored from {} in {:.1f} ms'.format(
+              'snapshot' if self.context.snapshot_restored else
+              'calibration', (time.perf_counter() - t) * 1e3))
+
+        os.remove(self.dirty_path)
+
     def __enter__(self):
         return self
 
@@ -302,6 +629,8 @@ if __name__ == '__main__':
                 with open(atexit_sh, mode='w') as f:
                     f.write('#!/bin/bash\n')
                     f.write('# This script is executed when the app exits.\n')
+                    f.write('# It is skipped if the gamma ramp captured at '
+                            'startup was restored.\n')
                     f.write('#\n')
                     f.write('# Examples:\n')
                     f.write('# xgamma -gamma 1.0\n')
@@ -312,7 +641,8 @@ if __name__ == '__main__':
                 os.chmod(atexit_sh, 0o755)
 
             def call_atexit_sh():
-                if platform.system() == 'Linux':
+                if (platform.system() == 'Linux' and
+                        not app.context.snapshot_restored):
                     subprocess.check_call([atexit_sh])
 
             atexit.register(call_atexit_sh)
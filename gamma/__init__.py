@@ -1,6 +1,12 @@
 from .context import Context, ContextError
-from .calibration import read_icc_ramp
-from .ramp import generate_ramp
+from .context_null import NullContext
+from .atlas import RampAtlas
+from .cache import RampCache
+from .calibration import CalibrationCache, read_icc_ramp
+from .ramp import Calibration, Ramp, generate_ramp
+from .worker import Worker
 
 
-__all__ = ['Context', 'ContextError', 'generate_ramp', 'read_icc_ramp']
+__all__ = ['Calibration', 'CalibrationCache', 'Context', 'ContextError',
+           'NullContext', 'Ramp', 'RampAtlas', 'RampCache', 'Worker',
+           'generate_ramp', 'read_icc_ramp']
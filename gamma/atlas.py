@@ -0,0 +1,146 @@
+import glob
+import hashlib
+import mmap
+import os
+import struct
+import time
+from ctypes import sizeof
+from .ramp import generate_ramp
+
+
+__all__ = ['RampAtlas']
+
+MAGIC = b'GRAT'
+VERSION = 1
+
+# magic, version, ramp size, item size, number of ramps, key digest
+HEADER = struct.Struct('<4sIIII20s')
+
+
+# Each entry is a ramp_ctype * size * 3 array that can be passed to
+# Context.set_ramp as is. The file name and the header are derived from the
+# ramp parameters, so changing any of them selects a different file. Only
+# the keep most recently used files of the directory are kept.
+class RampAtlas:
+
+    def __init__(self, directory, contrasts, size=256, gamma=1.0,
+                 temperature=6500, minimum=0.0, maximum=1.0,
+                 ramp_ctype=None, calibration=None, keep=4):
+        assert size > 1
+        assert ramp_ctype is not None
+        assert keep > 0
+
+        self.size = size
+        self.gamma = gamma
+        self.temperature = temperature
+        self.minimum = minimum
+        self.maximum = maximum
+        self.calibration = calibration
+        self.count = len(contrasts)
+        self.build_time = None
+        self.load_time = None
+
+        key = repr((size, ramp_ctype._type_, gamma, temperature, minimum,
+                    maximum, tuple(contrasts),
+                    calibration.digest if calibration is not None else None))
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+
+        self.path = os.path.join(directory,
+                                 'atlas-{}.bin'.format(digest.hex()[:16]))
+
+        entry_type = ramp_ctype * size * 3
+        entry_size = sizeof(entry_type)
+        header = HEADER.pack(MAGIC, VERSION, size, sizeof(ramp_ctype),
+                             self.count, digest)
+
+        self.file_size = HEADER.size + self.count * entry_size
+
+        if not self._is_valid(header):
+            t = time.perf_counter()
+
+            data = bytearray(self.file_size)
+            data[:HEADER.size] = header
+
+            for index, contrast in enumerate(contrasts):
+                offset = HEADER.size + index * entry_size
+                out = memoryview(data)[offset:offset + entry_size]
+
+                generate_ramp(size=size, gamma=gamma, contrast=contrast,
+                              temperature=temperature, minimum=minimum,
+                              maximum=maximum, calibration=calibration,
+                              out=out.cast(ramp_ctype._type_))
+
+            os.makedirs(directory, exist_ok=True)
+
+            temp_path = self.path + '.tmp'
+
+            with open(temp_path, mode='wb') as f:
+                f.write(data)
+
+            os.replace(temp_path, self.path)
+
+            self.build_time = time.perf_counter() - t
+        else:
+            # the modification time orders the files by last use
+            os.utime(self.path)
+
+        prune(directory, keep, self.path)
+
+        t = time.perf_counter()
+
+        with open(self.path, mode='rb') as f:
+            # a private copy-on-write mapping is writable, which ctypes
+            # requires for from_buffer; nothing is ever written back
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        self._ramps = [entry_type.from_buffer(self._mmap,
+                                              HEADER.size + i * entry_size)
+                       for i in range(self.count)]
+
+        self.load_time = time.perf_counter() - t
+
+    def _is_valid(self, header):
+        try:
+            with open(self.path, mode='rb') as f:
+                if f.read(HEADER.size) != header:
+                    return False
+
+            return os.path.getsize(self.path) == self.file_size
+        except OSError:
+            return False
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self._ramps[index]
+
+    def close(self):
+        self._ramps = []
+
+        try:
+            self._mmap.close()
+        except BufferError:
+            # a ramp is still referenced; the mapping is released with it
+            pass
+
+
+# Removes all but the keep most recently used atlas files of directory,
+# never current. A file that is still mapped cannot be removed on Windows
+# and is skipped.
+def prune(directory, keep, current=None):
+    paths = []
+
+    for path in glob.glob(os.path.join(directory, 'atlas-*.bin')):
+        try:
+            paths.append((path == current, os.stat(path).st_mtime_ns, path))
+        except OSError:
+            pass
+
+    paths.sort(reverse=True)
+
+    for _, _, path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+from ctypes import c_ushort
+from .calibration import read_icc_ramp
+from .context_null import NullContext
+from .ramp import generate_ramp, np, to_whitepoint
+from .synthetic import PROFILES
+
+
+__all__ = ['run', 'compare']
+
+SIZES = (256, 1024, 4096)
+
+
+# Each benchmark is a function returning the callable to be timed, so that
+# setup is not measured. A callable with a close method is closed once it
+# has been measured.
+def benchmarks():
+    for size in SIZES:
+        out = (c_ushort * size * 3)()
+
+        yield 'generate_ramp[{}]'.format(size), (
+            lambda size=size, out=out: lambda: generate_ramp(
+                size=size, gamma=0.9, contrast=0.6, temperature=5500,
+                out=out))
+
+    yield 'to_whitepoint', lambda: lambda: [
+        to_whitepoint(t) for t in range(1000, 25001, 500)]
+
+    for name, (make, system) in PROFILES.items():
+        for size in SIZES:
+            def setup(make=make, system=system, size=size):
+                data = make()
+                return lambda: read_icc_ramp(data, size=size, system=system)
+
+            yield 'read_icc_ramp[{},{}]'.format(name, size), setup
+
+    for size in SIZES:
+        yield 'App.handle_state[{}]'.format(size), (
+            lambda size=size: _app_handle_state(size))
+
+
+# The POST handling path from the body to the submitted ramp, with flash
+# levels cycling so that every update changes the ramp. The bodies are
+# tab-indented like the ones CS:GO sends, so that they are decoded by
+# select_state.
+def _app_handle_state(size):
+    from app import App
+
+    directory = tempfile.TemporaryDirectory(prefix='bench-')
+
+    app = App(path=directory.name, context=NullContext(ramp_size=size))
+
+    bodies = [json.dumps({'provider': {'steamid': '1'},
+                          'round': {'phase': 'live'},
+                          'player': {'steamid': '1',
+                                     'state': {'flashed': flashed,
+                                               'smoked': 0}}},
+                         indent='\t').encode()
+              for flashed in range(0, 256, 5)]
+
+    for body in bodies:
+        app.handle_state(body)
+        app.update_brightness()
+        app.worker.wait()
+
+    state = {'index': 0}
+
+    def handle():
+        index = state['index']
+        state['index'] = (index + 1) % len(bodies)
+
+        app.handle_state(bodies[index])
+        app.update_brightness()
+        app.worker.wait()
+
+    def close():
+        # App.close prints its statistics
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.close()
+
+        directory.cleanup()
+
+    handle.close = close
+
+    return handle
+
+
+def measure(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {'min': min(times), 'median': statistics.median(times),
+            'number': number}
+
+
+def run(pattern=None, repeat=5, stream=sys.stdout):
+    results = {}
+
+    for name, setup in benchmarks():
+        if pattern is not None and pattern not in name:
+            continue
+
+        try:
+            func = setup()
+        except ImportError as e:
+            print('{:<32} skipped: {}'.format(name, e), file=stream)
+            continue
+
+        try:
+            results[name] = measure(func, repeat)
+        finally:
+            if hasattr(func, 'close'):
+                func.close()
+
+        print('{:<32} {:>12.2f} us'.format(
+              name, results[name]['median'] * 1e6), file=stream)
+
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__ if np is not None else None,
+            'results': results}
+
+
+# Returns the report lines and the names of the benchmarks whose median got
+# slower than the baseline by more than threshold.
+def compare(baseline, current, threshold=0.1):
+    lines = ['{:<32} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline',
+                                                  'current', 'ratio')]
+    regressions = []
+
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            lines.append('{:<32} {:>12} {:>9.2f} us'.format(
+                name, '-', result['median'] * 1e6))
+            continue
+
+        old = baseline['results'][name]['median']
+        new = result['median']
+        ratio = new / old
+
+        if ratio > 1 + threshold:
+            verdict = 'slower'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            verdict = 'faster'
+        else:
+            verdict = ''
+
+        lines.append('{:<32} {:>9.2f} us {:>9.2f} us {:>7.2f}x {}'.format(
+            name, old * 1e6, new * 1e6, ratio, verdict).rstrip())
+
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m gamma.bench',
+        description='Benchmark the ramp, calibration and update paths.')
+    parser.add_argument('-k', dest='pattern',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the results as JSON; a '
+                        'saved result serves as baseline for --compare')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare against a saved result and exit with '
+                        'status 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as regression')
+
+    args = parser.parse_args(argv)
+
+    current = run(args.pattern, args.repeat)
+
+    if args.output is not None:
+        with open(args.output, mode='w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        lines, regressions = compare(baseline, current, args.threshold)
+
+        print()
+        print('\n'.join(lines))
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
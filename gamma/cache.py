@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from .ramp import generate_ramp
+
+
+__all__ = ['RampCache']
+
+# Parameters are quantized to the resolution of the 16-bit driver ramps;
+# parameter sets that differ by less than that cannot produce different
+# output and therefore share a cache entry.
+RESOLUTION = 65535
+
+
+def quantize(value):
+    if isinstance(value, (tuple, list)):
+        return tuple(quantize(v) for v in value)
+
+    return int(round(value * RESOLUTION))
+
+
+def dequantize(value):
+    if isinstance(value, tuple):
+        return tuple(dequantize(v) for v in value)
+
+    return value / RESOLUTION
+
+
+# With a ramp_ctype the cached ramps are packed ctypes arrays that contexts
+# submit as is. With a calibration they are already composed with it, so a
+# hit costs the same whether the display is calibrated or not.
+class RampCache:
+
+    def __init__(self, maxsize=256, ramp_ctype=None, calibration=None):
+        assert maxsize > 0
+
+        self.maxsize = maxsize
+        self.ramp_ctype = ramp_ctype
+        self.calibration = calibration
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._ramps = OrderedDict()
+
+    def __len__(self):
+        return len(self._ramps)
+
+    def clear(self):
+        self._ramps.clear()
+
+    def set_calibration(self, calibration):
+        if calibration != self.calibration:
+            self.calibration = calibration
+            self.clear()
+
+    def generate_ramp(self, size=256, gamma=1.0, brightness=0.0,
+                      contrast=1.0, temperature=6500, minimum=0.0,
+                      maximum=1.0):
+        if temperature is None:
+            temperature = 6500
+
+        if isinstance(temperature, (tuple, list)):
+            temperature = quantize(temperature)
+
+        key = (size, quantize(gamma), quantize(brightness),
+               quantize(contrast), temperature, quantize(minimum),
+               quantize(maximum))
+
+        ramps = self._ramps
+        ramp = ramps.get(key)
+
+        if ramp is not None:
+            ramps.move_to_end(key)
+            self.hits += 1
+            return ramp
+
+        self.misses += 1
+
+        if isinstance(temperature, tuple):
+            temperature = dequantize(temperature)
+
+        if self.ramp_ctype is not None:
+            out = (self.ramp_ctype * size * 3)()
+        else:
+            out = None
+
+        ramp = generate_ramp(size=size, gamma=dequantize(key[1]),
+                             brightness=dequantize(key[2]),
+                             contrast=dequantize(key[3]),
+                             temperature=temperature,
+                             minimum=dequantize(key[5]),
+                             maximum=dequantize(key[6]), out=out,
+                             calibration=self.calibration)
+
+        ramps[key] = ramp
+
+        if len(ramps) > self.maxsize:
+            ramps.popitem(last=False)
+            self.evictions += 1
+
+        return ramp
@@ -1,10 +1,20 @@
+import hashlib
+import mmap
+import os
 import struct
 import platform
 import xml.etree.ElementTree as ET
-from io import BytesIO
+from contextlib import contextmanager
+from io import UnsupportedOperation
+from .ramp import Ramp, pack_ramp
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-__all__ = ['read_icc_ramp']
+
+__all__ = ['CalibrationCache', 'read_icc_ramp']
 
 RGB = struct.unpack('>I', b'RGB ')[0]
 VCGT = struct.unpack('>I', b'vcgt')[0]
@@ -13,54 +23,186 @@ MS00 = struct.unpack('>I', b'MS00')[0]
 MS10 = struct.unpack('>I', b'MS10')[0]
 
 
-def unpack(fmt, fp):
-    size = struct.calcsize(fmt)
-    buffer = fp.read(size)
-    return struct.unpack('>' + fmt, buffer)
+TAG = struct.Struct('>III')
 
 
-def read_icc_ramp(file_or_bytes, size=256, system=None):
-    if isinstance(file_or_bytes, bytes):
-        fp = BytesIO(file_or_bytes)
-    else:
-        fp = file_or_bytes
+def read_tag_table(data):
+    num_tags = struct.unpack_from('>I', data, 128)[0]
+    tags = {}
 
-    assert size > 1
+    for i in range(num_tags):
+        tag_name, tag_offset, tag_size = TAG.unpack_from(data, 132 + 12 * i)
+        tags.setdefault(tag_name, (tag_offset, tag_size))
 
-    if system is None:
-        system = platform.system()
+    return tags
 
-    ramp = None
-    ramp_x = None
 
-    fp.seek(16)
+def unpack_channels(data, offset, num_entries, entry_size):
+    scale = pow(256, entry_size) - 1
 
-    color_space = unpack('I', fp)[0]
-    assert color_space == RGB
+    if np is not None:
+        table = np.frombuffer(data, dtype='>u{}'.format(entry_size),
+                              count=3 * num_entries, offset=offset)
+        return table.reshape(3, num_entries) / scale
 
-    fp.seek(128)
+    fmt = '>{}{}'.format(num_entries, 'BH'[entry_size - 1])
+    stride = num_entries * entry_size
 
-    num_tags = unpack('I', fp)[0]
+    return [[v / scale for v in struct.unpack_from(fmt, data,
+                                                   offset + i * stride)]
+            for i in range(3)]
 
-    cur_pos = fp.tell()
 
-    for i in range(num_tags):
-        fp.seek(cur_pos)
+@contextmanager
+def open_profile(file_or_bytes):
+    if not hasattr(file_or_bytes, 'read'):
+        yield file_or_bytes
+        return
 
-        tag_name, tag_offset, tag_size = unpack('III', fp)
+    try:
+        data = mmap.mmap(file_or_bytes.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, UnsupportedOperation):
+        file_or_bytes.seek(0)
+        yield file_or_bytes.read()
+        return
 
-        cur_pos = fp.tell()
+    try:
+        yield data
+    finally:
+        try:
+            data.close()
+        except BufferError:
+            # still exported while an exception unwinds; the mapping is
+            # released together with the traceback
+            pass
 
-        if tag_name == MS00 and system == 'Windows':
-            fp.seek(tag_offset)
 
-            tag_type, _, cdmp_offset, cdmp_size = unpack('4I', fp)
+def read_icc_ramp(file_or_bytes, size=256, system=None, typecode='f'):
+    with open_profile(file_or_bytes) as data:
+        return _read_icc_ramp(data, size, system, typecode)
+
+
+# Resampled calibration ramps stored in one small binary file and keyed by
+# a digest of the profile contents, the ramp size, the typecode and the
+# system, so a profile is parsed again only after it has changed.
+class CalibrationCache:
+
+    MAGIC = b'GCAL'
+    VERSION = 1
+
+    HEADER = struct.Struct('<4sII')
+    ENTRY = struct.Struct('<20sIc3x')
+
+    def __init__(self, path, maxsize=8):
+        assert maxsize > 0
+
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+
+    def read_icc_ramp(self, file_or_bytes, size=256, system=None,
+                      typecode='f'):
+        if system is None:
+            system = platform.system()
+
+        with open_profile(file_or_bytes) as data:
+            digest = hashlib.sha1(data)
+            digest.update(repr((size, typecode, system)).encode('utf-8'))
+            key = digest.digest()
+
+            entries = self._load()
+            ramp = entries.get(key)
+
+            if ramp is not None:
+                self.hits += 1
+                return ramp
+
+            self.misses += 1
+
+            ramp = _read_icc_ramp(data, size, system, typecode)
+
+        entries.pop(key, None)
+        entries[key] = ramp
+
+        while len(entries) > self.maxsize:
+            del entries[next(iter(entries))]
+
+        try:
+            self._store(entries)
+        except OSError:
+            pass
+
+        return ramp
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+
+        entries = {}
+
+        try:
+            with open(self.path, mode='rb') as f:
+                data = f.read()
+
+            magic, version, count = self.HEADER.unpack_from(data, 0)
+
+            if magic == self.MAGIC and version == self.VERSION:
+                offset = self.HEADER.size
+
+                for _ in range(count):
+                    key, size, typecode = self.ENTRY.unpack_from(data, offset)
+                    typecode = typecode.decode('ascii')
+                    offset += self.ENTRY.size
+                    nbytes = 3 * size * (2 if typecode == 'H' else 4)
+                    entries[key] = Ramp(size, typecode,
+                                        data[offset:offset + nbytes])
+                    offset += nbytes
+        except (OSError, struct.error, AssertionError, ValueError):
+            entries = {}
+
+        self._entries = entries
+        return entries
+
+    def _store(self, entries):
+        chunks = [self.HEADER.pack(self.MAGIC, self.VERSION, len(entries))]
+
+        for key, ramp in entries.items():
+            chunks.append(self.ENTRY.pack(key, ramp.size,
+                                          ramp.typecode.encode('ascii')))
+            chunks.append(ramp.tobytes())
+
+        temp_path = self.path + '.tmp'
+
+        with open(temp_path, mode='wb') as f:
+            f.write(b''.join(chunks))
+
+        os.replace(temp_path, self.path)
+
+
+def _read_icc_ramp(data, size, system, typecode):
+    assert size > 1
+
+    if system is None:
+        system = platform.system()
+
+    ramp = None
+    ramp_x = None
+
+    color_space = struct.unpack_from('>I', data, 16)[0]
+    assert color_space == RGB
+
+    for tag_name, (tag_offset, tag_size) in read_tag_table(data).items():
+        if tag_name == MS00 and system == 'Windows':
+            tag_type, _, cdmp_offset, cdmp_size = struct.unpack_from(
+                '>4I', data, tag_offset)
 
             if tag_type != MS10:
                 continue
 
-            fp.seek(tag_offset + cdmp_offset)
-            cdmp = fp.read(cdmp_size)
+            cdmp_offset += tag_offset
+            cdmp = bytes(data[cdmp_offset:cdmp_offset + cdmp_size])
 
             def cdm(name):
                 return ('{http://schemas.microsoft.com/windows/2005/02/color' +
@@ -153,20 +295,23 @@ def read_icc_ramp(file_or_bytes, size=256, system=None):
                 hdr_curves = adapter_gamma_conf.find(
                         cal('HDRToneResponseCurves'))
 
-                trc_length = hdr_curves.get('TRCLength')
+                trc_length = int(hdr_curves.get('TRCLength'))
 
                 red_trc = hdr_curves.find(wcs('RedTRC'))
                 green_trc = hdr_curves.find(wcs('GreenTRC'))
                 blue_trc = hdr_curves.find(wcs('BlueTRC'))
 
-                r_ramp_x = red_trc.get(wcs('Input')).text.split()
-                r_ramp = red_trc.get(wcs('Output')).text.split()
-                g_ramp_x = green_trc.get(wcs('Input')).text.split()
-                g_ramp = green_trc.get(wcs('Output')).text.split()
-                b_ramp_x = blue_trc.get(wcs('Input')).text.split()
-                b_ramp = blue_trc.get(wcs('Output')).text.split()
+                def values(trc, name):
+                    return [float(v) for v in trc.find(wcs(name)).text.split()]
 
-                ramp = (r_ramp, g_ramp, b_ramp)
+                r_ramp_x = values(red_trc, 'Input')
+                r_ramp = values(red_trc, 'Output')
+                g_ramp_x = values(green_trc, 'Input')
+                g_ramp = values(green_trc, 'Output')
+                b_ramp_x = values(blue_trc, 'Input')
+                b_ramp = values(blue_trc, 'Output')
+
+                ramp = [r_ramp, g_ramp, b_ramp]
                 ramp_x = [r_ramp_x, g_ramp_x, b_ramp_x]
 
                 assert all(len(x) == trc_length for x in (ramp_x + ramp))
@@ -174,27 +319,18 @@ def read_icc_ramp(file_or_bytes, size=256, system=None):
             break
 
         if tag_name == MLUT:
-            fp.seek(tag_offset)
-
-            array = unpack('768H', fp)
-
-            r_ramp = [array[i] / 65535 for i in range(256)]
-            g_ramp = [array[i + 256] / 65535 for i in range(256)]
-            b_ramp = [array[i + 512] / 65535 for i in range(256)]
-
-            ramp = (r_ramp, g_ramp, b_ramp)
+            ramp = unpack_channels(data, tag_offset, 256, 2)
             break
 
         if tag_name == VCGT:
-            fp.seek(tag_offset)
-
-            tag_type, _, gamma_type = unpack('III', fp)
+            tag_type, _, gamma_type = TAG.unpack_from(data, tag_offset)
 
             assert tag_type == VCGT
             assert gamma_type in (0, 1)
 
             if gamma_type == 0:
-                num_channels, num_entries, entry_size = unpack('HHH', fp)
+                num_channels, num_entries, entry_size = struct.unpack_from(
+                    '>HHH', data, tag_offset + 12)
 
                 if tag_size == 1584:
                     entry_size = 2
@@ -204,17 +340,10 @@ def read_icc_ramp(file_or_bytes, size=256, system=None):
                 assert num_channels == 3
                 assert entry_size in (1, 2)
 
-                array = unpack(str(num_entries * 3) + 'BH'[entry_size - 1], fp)
-
-                entry_size = pow(256, entry_size) - 1
-
-                r_ramp = [array[i] / entry_size for i in range(num_entries)]
-                g_ramp = [array[i + 256] / entry_size
-                          for i in range(num_entries)]
-                b_ramp = [array[i + 512] / entry_size
-                          for i in range(num_entries)]
+                ramp = unpack_channels(data, tag_offset + 18, num_entries,
+                                       entry_size)
             else:
-                array = unpack('9I', fp)
+                array = struct.unpack_from('>9I', data, tag_offset + 12)
 
                 gamma_mult = 2.2 if system == 'Windows' else 1.0
 
@@ -235,48 +364,86 @@ def read_icc_ramp(file_or_bytes, size=256, system=None):
                 b_ramp = [pow(i / (size - 1), b_gamma) * (b_max - b_min)
                           + b_min for i in range(size)]
 
-            ramp = (r_ramp, g_ramp, b_ramp)
+                ramp = (r_ramp, g_ramp, b_ramp)
+
             break
 
     if ramp is None:
         ramp = [[i / (size - 1) for i in range(size)] for _ in range(3)]
 
+    if np is not None:
+        return _resample_numpy(ramp, ramp_x, size, typecode)
+
+    return _resample_python(ramp, ramp_x, size, typecode)
+
+
+# Both resamplers interpolate linearly between neighbouring table entries
+# and hold the first and last entries outside of the table's input range.
+def _resample_python(ramp, ramp_x, size, typecode):
     ramp_size = len(ramp[0])
 
     if ramp_x is None:
         ramp_x = [[i / (ramp_size - 1) for i in range(ramp_size)]
                   for _ in range(3)]
 
-    def interpolate(ramp_x, ramp, x):
+    out = [None, None, None]
+
+    for c in range(3):
+        xs = ramp_x[c]
+        ys = ramp[c]
+        channel = [0.0] * size
         i = 0
 
-        while i < ramp_size:
-            if x < ramp_x[i]:
-                break
+        # the sample positions increase monotonically, so a single merge
+        # pass over the table finds every interval
+        for j in range(size):
+            x = j / (size - 1)
 
-            i += 1
+            while i < ramp_size and x >= xs[i]:
+                i += 1
 
-        if i == 0:
-            return ramp[0]
+            if i == 0:
+                y = ys[0]
+            elif i == ramp_size:
+                y = ys[-1]
+            else:
+                x1 = xs[i - 1]
+                y1 = ys[i - 1]
+                y = y1 + (ys[i] - y1) * (x - x1) / (xs[i] - x1)
 
-        if i == ramp_size:
-            return ramp[-1]
+            channel[j] = min(max(y, 0.0), 1.0)
 
-        x1 = ramp_x[i - 1]
-        x2 = ramp_x[i]
-        y1 = ramp[i - 1]
-        y2 = ramp[i]
+        out[c] = channel
 
-        dx = x2 - x1
-        dy = y2 - y1
+    return pack_ramp(out, Ramp(size, typecode))
 
-        return y1 + dy * (x - x1) / (dx * dx)
 
-    ramp = [[interpolate(ramp_x[i], ramp[i], j / (size - 1))
-             for j in range(size)] for i in range(3)]
+def _resample_numpy(ramp, ramp_x, size, typecode):
+    x = np.arange(size, dtype=np.float64) / (size - 1)
 
-    for i in range(3):
-        for j in range(size):
-            ramp[i][j] = min(max(ramp[i][j], 0.0), 1.0)
+    if ramp_x is None:
+        # uniform tables: one index/weight computation serves all channels
+        table = np.array(ramp, dtype=np.float64)
+        ramp_size = table.shape[1]
+
+        position = x * (ramp_size - 1)
+        index = np.minimum(position.astype(np.intp), ramp_size - 2)
+        weight = position - index
+
+        values = table[:, index]
+        values += (table[:, index + 1] - values) * weight
+    else:
+        values = np.array([np.interp(x, np.array(ramp_x[c], dtype=np.float64),
+                                     np.array(ramp[c], dtype=np.float64))
+                           for c in range(3)])
+
+    np.clip(values, 0.0, 1.0, out=values)
+
+    out = Ramp(size, typecode)
+    view = np.asarray(memoryview(out)).reshape(3, size)
+
+    if typecode == 'H':
+        values *= 65535
 
-    return ramp
+    np.copyto(view, values, casting='unsafe')
+    return out
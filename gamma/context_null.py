@@ -0,0 +1,70 @@
+import time
+from array import array
+from ctypes import memmove, sizeof, c_float, c_ushort
+from .context import Context
+from .ramp import Ramp, generate_ramp
+
+
+__all__ = ['NullContext']
+
+
+# A context without a display. Submitted ramps are kept, together with the
+# time the simulated driver call returned, in a ring buffer of the last
+# history submissions that is allocated up front, so that recording does
+# not allocate on the submission path.
+class NullContext(Context):
+
+    def __init__(self, *args, ramp_size=256, ramp_ctype=c_ushort,
+                 latency=0.0, history=1024, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        assert ramp_size > 1
+        assert ramp_ctype in (c_ushort, c_float)
+        assert history > 0
+
+        self.ramp_ctype = ramp_ctype
+        self.ramp_size = ramp_size
+        self.latency = latency
+        self.history = history
+
+        self._allocate_ramp_buffer()
+
+        entry_type = ramp_ctype * ramp_size * 3
+        self._screen = entry_type()
+        self._ring = (entry_type * history)()
+        self._ring_times = array('d', bytes(8 * history))
+        self._ring_count = 0
+
+        generate_ramp(size=ramp_size, out=self._screen)
+
+        self._take_snapshot()
+
+    def get_ramp(self):
+        ramp = Ramp(self.ramp_size, self.ramp_ctype._type_)
+        memmove(ramp.buffer_info()[0], self._screen, sizeof(self._screen))
+        return ramp
+
+    def _submit_ramp_buffer(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+        nbytes = sizeof(self._screen)
+        memmove(self._screen, self._ramp_buffer, nbytes)
+
+        index = self._ring_count % self.history
+        memmove(self._ring[index], self._ramp_buffer, nbytes)
+        self._ring_times[index] = time.perf_counter()
+        self._ring_count += 1
+
+    # The recorded (timestamp, ramp) pairs, oldest first.
+    def records(self):
+        count = min(self._ring_count, self.history)
+        start = self._ring_count - count
+
+        return [(self._ring_times[i % self.history],
+                 Ramp(self.ramp_size, self.ramp_ctype._type_,
+                      bytes(self._ring[i % self.history])))
+                for i in range(start, self._ring_count)]
+
+    def close(self):
+        self._restore_snapshot()
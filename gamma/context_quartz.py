@@ -1,9 +1,10 @@
 from ctypes import byref, sizeof, c_float, c_uint32, cdll
 from ctypes.util import find_library
 from .context import Context, ContextError
+from .ramp import Ramp
 
 
-__all__ = ['Context', 'ContextError']
+__all__ = ['QuartzContext']
 
 C_FLOAT_SIZE = sizeof(c_float)
 
@@ -33,6 +34,8 @@ def CGDisplayGammaTableCapacity(display):
 
 class QuartzContext(Context):
 
+    ramp_ctype = c_float
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -42,13 +45,24 @@ class QuartzContext(Context):
         if self.ramp_size <= 1:
             raise ContextError('Gamma ramp size is too small')
 
+        self._allocate_ramp_buffer()
+
+        ramp_size = self.ramp_size
+        self._gamma_r = byref(self._ramp_buffer, 0 * ramp_size * C_FLOAT_SIZE)
+        self._gamma_g = byref(self._ramp_buffer, 1 * ramp_size * C_FLOAT_SIZE)
+        self._gamma_b = byref(self._ramp_buffer, 2 * ramp_size * C_FLOAT_SIZE)
+        self._table_size = c_uint32(ramp_size)
+
+        self._take_snapshot()
+
     def get_ramp(self):
         ramp_size = self.ramp_size
-        ramp = (c_float * ramp_size * 3)()
+        ramp = Ramp(ramp_size, 'f')
+        _ramp = (c_float * ramp_size * 3).from_buffer(ramp)
 
-        gamma_r = byref(ramp, 0 * ramp_size * C_FLOAT_SIZE)
-        gamma_g = byref(ramp, 1 * ramp_size * C_FLOAT_SIZE)
-        gamma_b = byref(ramp, 2 * ramp_size * C_FLOAT_SIZE)
+        gamma_r = byref(_ramp, 0 * ramp_size * C_FLOAT_SIZE)
+        gamma_g = byref(_ramp, 1 * ramp_size * C_FLOAT_SIZE)
+        gamma_b = byref(_ramp, 2 * ramp_size * C_FLOAT_SIZE)
 
         sample_count = c_uint32()
 
@@ -61,25 +75,16 @@ class QuartzContext(Context):
 
         assert sample_count.value == ramp_size
 
-        return [[ramp[i][j] for j in range(ramp_size)] for i in range(3)]
-
-    def set_ramp(self, ramp):
-        ramp_size = self.ramp_size
-        _ramp = (c_float * ramp_size * 3)()
-
-        for i in range(3):
-            for j in range(ramp_size):
-                _ramp[i][j] = ramp[i][j]
-
-        gamma_r = byref(_ramp, 0 * ramp_size * C_FLOAT_SIZE)
-        gamma_g = byref(_ramp, 1 * ramp_size * C_FLOAT_SIZE)
-        gamma_b = byref(_ramp, 2 * ramp_size * C_FLOAT_SIZE)
+        return ramp
 
-        error = CGSetDisplayTransferByTable(self._display, c_uint32(ramp_size),
-                                            gamma_r, gamma_g, gamma_b)
+    def _submit_ramp_buffer(self):
+        error = CGSetDisplayTransferByTable(self._display, self._table_size,
+                                            self._gamma_r, self._gamma_g,
+                                            self._gamma_b)
 
         if error != kCGErrorSuccess:
             raise ContextError('Unable to set gamma ramp')
 
     def close(self):
-        CGDisplayRestoreColorSyncSettings()
+        if not self._restore_snapshot():
+            CGDisplayRestoreColorSyncSettings()
@@ -4,10 +4,10 @@ from ctypes import create_unicode_buffer, POINTER
 from ctypes.wintypes import DWORD, HDC, WCHAR, WORD
 from winreg import (HKEY_LOCAL_MACHINE, OpenKeyEx, CloseKey, QueryValueEx,
                     KEY_READ, KEY_WOW64_64KEY)
-from .calibration import read_icc_ramp
 from .context import Context, ContextError
+from .ramp import Ramp
 
-__all__ = ['Context']
+__all__ = ['WinGdiContext']
 
 ICM_KEY = 'SOFTWARE\Microsoft\Windows NT\CurrentVersion\ICM'
 
@@ -16,6 +16,9 @@ DISPLAY_DEVICE_PRIMARY_DEVICE = 4
 COLORMGMTCAPS = 121
 CM_GAMMA_RAMP = 2
 
+# SetDeviceGammaRamp fails spuriously now and then
+MAX_ATTEMPTS = 10
+
 
 class DISPLAY_DEVICE(Structure):
     _fields_ = [('cb', DWORD),
@@ -50,16 +53,19 @@ def GetDC(hWnd):
     return HDC(_GetDC(hWnd))
 
 
+# Returns the number of attempts it took, or 0 if all of them failed.
 def SetDeviceGammaRamp(hDC, lpRamp):
-    for _ in range(10):
+    for attempt in range(1, MAX_ATTEMPTS + 1):
         if _SetDeviceGammaRamp(hDC, lpRamp):
-            return 1
+            return attempt
 
     return 0
 
 
 class WinGdiContext(Context):
 
+    ramp_ctype = WORD
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -129,6 +135,16 @@ class WinGdiContext(Context):
 
         self.ramp_size = 256
 
+        self._allocate_ramp_buffer()
+        self._ramp_ref = byref(self._ramp_buffer)
+
+        # Windows has no cheap notification for profile changes; the
+        # calibration is read once and kept for the rest of the session
+        self._calibration = None
+        self._calibration_read = False
+
+        self._take_snapshot()
+
     @contextmanager
     def _get_dc(self):
         hdc = self._hdc
@@ -149,57 +165,71 @@ class WinGdiContext(Context):
 
     def get_ramp(self):
         with self._get_dc() as hdc:
-            ramp = (WORD * 256 * 3)()
+            ramp = Ramp(256, 'H')
 
-            if not GetDeviceGammaRamp(hdc, byref(ramp)):
+            if not GetDeviceGammaRamp(hdc, byref(
+                    (WORD * 256 * 3).from_buffer(ramp))):
                 raise ContextError('Unable to get gamma ramp')
 
-            return [[ramp[i][j] / 65535 for j in range(256)] for i in range(3)]
+            return ramp
 
-    def set_ramp(self, ramp):
-        _ramp = (WORD * 256 * 3)()
+    def _submit_ramp_buffer(self):
+        with self._get_dc() as hdc:
+            self._set_device_gamma_ramp(hdc, self._ramp_ref,
+                                        'Unable to set gamma ramp; has the '
+                                        'gamma range been unlocked yet?')
 
-        for i in range(3):
-            for j in range(256):
-                _ramp[i][j] = int(65535 * ramp[i][j])
+    def _set_device_gamma_ramp(self, hdc, ramp, message):
+        attempts = SetDeviceGammaRamp(hdc, ramp)
+        self.retries += (attempts or MAX_ATTEMPTS) - 1
 
-        with self._get_dc() as hdc:
-            if not SetDeviceGammaRamp(hdc, byref(_ramp)):
-                raise ContextError('Unable to set gamma ramp; has the gamma '
-                                   'range been unlocked yet?')
+        if not attempts:
+            raise ContextError(message)
 
-    def close(self):
-        try:
-            with self._get_dc() as hdc:
-                ramp = None
+    def get_calibration_ramp(self):
+        if not self._calibration_read:
+            self._calibration_read = True
 
-                try:
-                    cbName = DWORD(0)
+            try:
+                self._calibration = self._read_calibration()
+            except Exception:
+                self._calibration = None
+
+        return self._calibration
+
+    def _read_calibration(self):
+        with self._get_dc() as hdc:
+            cbName = DWORD(0)
+
+            GetICMProfile(hdc, byref(cbName), None)
 
-                    GetICMProfile(hdc, byref(cbName), None)
+            filename = create_unicode_buffer(cbName.value)
 
-                    filename = create_unicode_buffer(cbName.value)
+            GetICMProfile(hdc, byref(cbName), filename)
 
-                    GetICMProfile(hdc, byref(cbName), filename)
+        with open(filename.value, mode='rb') as f:
+            return self._read_icc_ramp(f, 256)
 
-                    with open(filename.value, mode='rb') as f:
-                        icc_ramp = read_icc_ramp(f, size=256)
+    def close(self):
+        try:
+            if self._restore_snapshot():
+                return
 
-                    ramp = (WORD * 256 * 3)()
+            with self._get_dc() as hdc:
+                ramp = (WORD * 256 * 3)()
+                icc_ramp = self.get_calibration_ramp()
 
+                if icc_ramp is not None:
+                    for i, channel in enumerate(icc_ramp.channels()):
+                        for j in range(256):
+                            ramp[i][j] = int(255 * channel[j] + 0.5) << 8
+                else:
                     for i in range(3):
                         for j in range(256):
-                            ramp[i][j] = int(255 * icc_ramp[i][j] + 0.5) << 8
-                finally:
-                    if ramp is None:
-                        ramp = (WORD * 256 * 3)()
-
-                        for i in range(3):
-                            for j in range(256):
-                                ramp[i][j] = j << 8
+                            ramp[i][j] = j << 8
 
-                    if not SetDeviceGammaRamp(hdc, byref(ramp)):
-                        raise ContextError('Unable to restore gamma ramp')
+                self._set_device_gamma_ramp(hdc, byref(ramp),
+                                            'Unable to restore gamma ramp')
         finally:
             if self._hdc is not None:
                 if not DeleteDC(self._hdc):
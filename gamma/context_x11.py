@@ -0,0 +1,215 @@
+import os
+import select
+import threading
+from ctypes import byref, cast, cdll, Structure, Union, POINTER
+from ctypes import c_ubyte, c_int, c_long, c_ulong, c_void_p
+from ctypes.util import find_library
+from .context import Context, ContextError
+
+
+__all__ = ['X11Context']
+
+c_uchar = c_ubyte
+c_uchar_p = POINTER(c_uchar)
+
+X11 = cdll.LoadLibrary(find_library('X11'))
+
+# the watch thread makes Xlib calls next to the thread setting the ramps;
+# this has to come before any other Xlib call
+X11.XInitThreads()
+
+XA_CARDINAL = 6
+
+XNone = 0
+XSuccess = 0
+
+PropertyNotify = 28
+PropertyChangeMask = 1 << 22
+
+# upper bound, in 32-bit units, for reading a property in one request
+MAX_PROPERTY_LENGTH = 1 << 24
+
+XWindow = c_ulong
+XAtom = c_ulong
+
+
+class XPropertyEvent(Structure):
+    _fields_ = [('type', c_int),
+                ('serial', c_ulong),
+                ('send_event', c_int),
+                ('display', c_void_p),
+                ('window', XWindow),
+                ('atom', XAtom),
+                ('time', c_ulong),
+                ('state', c_int)]
+
+
+class XEvent(Union):
+    _fields_ = [('type', c_int),
+                ('xproperty', XPropertyEvent),
+                ('pad', c_long * 24)]
+
+
+_XOpenDisplay = X11.XOpenDisplay
+XCloseDisplay = X11.XCloseDisplay
+XDefaultScreen = X11.XDefaultScreen
+_XRootWindow = X11.XRootWindow
+_XInternAtom = X11.XInternAtom
+XGetWindowProperty = X11.XGetWindowProperty
+XSelectInput = X11.XSelectInput
+XSync = X11.XSync
+XPending = X11.XPending
+XNextEvent = X11.XNextEvent
+XConnectionNumber = X11.XConnectionNumber
+XFree = X11.XFree
+
+_XOpenDisplay.restype = c_void_p
+_XInternAtom.restype = XAtom
+_XRootWindow.restype = XWindow
+
+
+def XOpenDisplay(display_name):
+    return c_void_p(_XOpenDisplay(display_name))
+
+
+def XRootWindow(display, screen_num):
+    return XWindow(_XRootWindow(display, screen_num))
+
+
+def XInternAtom(display, atom_name, only_if_exists):
+    return XAtom(_XInternAtom(display, atom_name, only_if_exists))
+
+
+# Owns the display connection and the calibration read from _ICC_PROFILE,
+# which is shared by the X11 backends.
+class X11Context(Context):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        display = XOpenDisplay(None)
+
+        if not display:
+            raise ContextError('X request failed: XOpenDisplay')
+
+        self._display = display
+
+        screen_num = XDefaultScreen(display)
+        self._screen_num = screen_num
+        self._root = XRootWindow(display, screen_num)
+
+        self._icc_profile = XInternAtom(display, b'_ICC_PROFILE', False)
+        self._calibration = None
+        self._calibration_stale = True
+        self.calibration_reads = 0
+
+        try:
+            self._start_watch()
+        except:
+            XCloseDisplay(display)
+            raise
+
+    # Calibration changes are watched for on a second connection that only
+    # the watch thread reads from. Events are drained as soon as they
+    # arrive, so they cannot pile up while no ramp is being set, and the
+    # connection used for the gamma requests never receives any.
+    def _start_watch(self):
+        watch = XOpenDisplay(None)
+
+        if not watch:
+            raise ContextError('X request failed: XOpenDisplay')
+
+        try:
+            self._select_calibration_events(watch)
+            XSync(watch, False)
+            self._wake_fd, self._wake_write_fd = os.pipe()
+        except:
+            XCloseDisplay(watch)
+            raise
+
+        self._watch = watch
+        self._watch_thread = threading.Thread(target=self._run_watch,
+                                              name='X11 watch', daemon=True)
+        self._watch_thread.start()
+
+    def _select_calibration_events(self, watch):
+        XSelectInput(watch, XRootWindow(watch, self._screen_num),
+                     c_long(PropertyChangeMask))
+
+    def _is_calibration_event(self, event):
+        return (event.type == PropertyNotify and
+                event.xproperty.atom == self._icc_profile.value)
+
+    def _run_watch(self):
+        watch = self._watch
+        event = XEvent()
+        fds = [XConnectionNumber(watch), self._wake_fd]
+
+        while True:
+            # XPending reads whatever the server has sent and returns the
+            # number of queued events; select only sees the socket, so the
+            # queue has to be empty before blocking
+            while XPending(watch):
+                XNextEvent(watch, byref(event))
+
+                if self._is_calibration_event(event):
+                    self._calibration_stale = True
+
+            readable, _, _ = select.select(fds, [], [])
+
+            if self._wake_fd in readable:
+                return
+
+    def _close_display(self):
+        os.write(self._wake_write_fd, b'\0')
+        self._watch_thread.join()
+
+        os.close(self._wake_fd)
+        os.close(self._wake_write_fd)
+        XCloseDisplay(self._watch)
+        XCloseDisplay(self._display)
+
+    def get_calibration_ramp(self):
+        # cleared before reading, so that a change during the read is not
+        # lost
+        if self._calibration_stale:
+            self._calibration_stale = False
+            self._calibration = self._read_calibration()
+            self.calibration_reads += 1
+
+        return self._calibration
+
+    def _read_calibration(self, size=None):
+        actual_type = XAtom()
+        actual_format = c_int()
+        nitems = c_ulong()
+        bytes_after = c_ulong()
+        data = c_uchar_p()
+
+        if XGetWindowProperty(self._display, self._root, self._icc_profile,
+                              c_long(0), c_long(MAX_PROPERTY_LENGTH), False,
+                              XAtom(XA_CARDINAL), byref(actual_type),
+                              byref(actual_format), byref(nitems),
+                              byref(bytes_after), byref(data)) != XSuccess:
+            raise ContextError('X request failed: XGetWindowProperty')
+
+        return self._parse_calibration(data, nitems, bytes_after,
+                                       size or self.ramp_size)
+
+    # Parses an _ICC_PROFILE property returned by Xlib and frees it.
+    def _parse_calibration(self, data, nitems, bytes_after, size):
+        try:
+            if not data or bytes_after.value != 0:
+                return None
+
+            # parse the property in place instead of copying it
+            profile = cast(data, POINTER(c_uchar * nitems.value))
+
+            return self._read_icc_ramp(memoryview(profile.contents), size)
+        except ContextError:
+            raise
+        except Exception:
+            return None
+        finally:
+            if data:
+                XFree(data)
@@ -0,0 +1,476 @@
+import time
+from array import array
+from ctypes import addressof, byref, cast, memmove, sizeof, cdll, Structure
+from ctypes import POINTER, c_ushort, c_int, c_uint, c_long, c_ulong, c_void_p
+from ctypes.util import find_library
+from .context import ContextError, is_plausible
+from .context_x11 import X11Context, XRootWindow, XSync, X11, XAtom
+from .context_x11 import XWindow, c_uchar_p
+from .context_x11 import MAX_PROPERTY_LENGTH, XA_CARDINAL, XSuccess
+from .ramp import Calibration, Ramp
+
+
+__all__ = ['XRandRContext']
+
+C_USHORT_SIZE = sizeof(c_ushort)
+C_USHORT_MAX = c_ushort(~0).value
+
+_path = find_library('Xrandr')
+
+if _path is None:
+    raise ImportError('libXrandr is not available')
+
+Xrandr = cdll.LoadLibrary(_path)
+
+RRCrtc = c_ulong
+RRMode = c_ulong
+RROutput = c_ulong
+XTime = c_ulong
+
+RRNotify = 1
+RRNotify_OutputProperty = 2
+RROutputPropertyNotifyMask = 1 << 3
+
+
+class XRRScreenResources(Structure):
+    _fields_ = [('timestamp', XTime),
+                ('configTimestamp', XTime),
+                ('ncrtc', c_int),
+                ('crtcs', POINTER(RRCrtc)),
+                ('noutput', c_int),
+                ('outputs', POINTER(RROutput)),
+                ('nmode', c_int),
+                ('modes', c_void_p)]
+
+
+class XRRCrtcInfo(Structure):
+    _fields_ = [('timestamp', XTime),
+                ('x', c_int),
+                ('y', c_int),
+                ('width', c_uint),
+                ('height', c_uint),
+                ('mode', RRMode),
+                ('rotation', c_ushort),
+                ('noutput', c_int),
+                ('outputs', POINTER(RROutput)),
+                ('rotations', c_ushort),
+                ('npossible', c_int),
+                ('possible', POINTER(RROutput))]
+
+
+class XRRCrtcGamma(Structure):
+    _fields_ = [('size', c_int),
+                ('red', POINTER(c_ushort)),
+                ('green', POINTER(c_ushort)),
+                ('blue', POINTER(c_ushort))]
+
+
+class XRROutputPropertyNotifyEvent(Structure):
+    _fields_ = [('type', c_int),
+                ('serial', c_ulong),
+                ('send_event', c_int),
+                ('display', c_void_p),
+                ('window', XWindow),
+                ('subtype', c_int),
+                ('output', RROutput),
+                ('property', XAtom),
+                ('timestamp', XTime),
+                ('state', c_int)]
+
+
+XFlush = X11.XFlush
+XRRQueryExtension = Xrandr.XRRQueryExtension
+XRRQueryVersion = Xrandr.XRRQueryVersion
+XRRSelectInput = Xrandr.XRRSelectInput
+XRRGetScreenResources = getattr(Xrandr, 'XRRGetScreenResourcesCurrent',
+                                Xrandr.XRRGetScreenResources)
+XRRFreeScreenResources = Xrandr.XRRFreeScreenResources
+XRRGetCrtcInfo = Xrandr.XRRGetCrtcInfo
+XRRFreeCrtcInfo = Xrandr.XRRFreeCrtcInfo
+XRRGetCrtcGammaSize = Xrandr.XRRGetCrtcGammaSize
+XRRGetCrtcGamma = Xrandr.XRRGetCrtcGamma
+XRRSetCrtcGamma = Xrandr.XRRSetCrtcGamma
+XRRFreeGamma = Xrandr.XRRFreeGamma
+XRRGetOutputProperty = Xrandr.XRRGetOutputProperty
+XRRGetOutputPrimary = getattr(Xrandr, 'XRRGetOutputPrimary', None)
+
+XRRGetScreenResources.restype = POINTER(XRRScreenResources)
+XRRGetScreenResources.argtypes = [c_void_p, c_ulong]
+XRRFreeScreenResources.argtypes = [POINTER(XRRScreenResources)]
+XRRGetCrtcInfo.restype = POINTER(XRRCrtcInfo)
+XRRGetCrtcInfo.argtypes = [c_void_p, POINTER(XRRScreenResources), RRCrtc]
+XRRFreeCrtcInfo.argtypes = [POINTER(XRRCrtcInfo)]
+XRRGetCrtcGammaSize.argtypes = [c_void_p, RRCrtc]
+XRRGetCrtcGamma.restype = POINTER(XRRCrtcGamma)
+XRRGetCrtcGamma.argtypes = [c_void_p, RRCrtc]
+XRRSetCrtcGamma.restype = None
+XRRSetCrtcGamma.argtypes = [c_void_p, RRCrtc, POINTER(XRRCrtcGamma)]
+XRRFreeGamma.argtypes = [POINTER(XRRCrtcGamma)]
+XRRSelectInput.restype = None
+XRRSelectInput.argtypes = [c_void_p, XWindow, c_int]
+XRRGetOutputProperty.argtypes = [c_void_p, RROutput, XAtom, c_long, c_long,
+                                 c_int, c_int, XAtom, POINTER(XAtom),
+                                 POINTER(c_int), POINTER(c_ulong),
+                                 POINTER(c_ulong), POINTER(c_uchar_p)]
+
+if XRRGetOutputPrimary is not None:
+    XRRGetOutputPrimary.restype = RROutput
+    XRRGetOutputPrimary.argtypes = [c_void_p, XWindow]
+
+
+# An XRRCrtcGamma whose channels point into a ushort * size * 3 buffer, so
+# that ramps can be submitted without XRRAllocGamma and a copy.
+def crtc_gamma(address, size):
+    gamma = XRRCrtcGamma()
+    gamma.size = size
+    gamma.red = cast(c_void_p(address), POINTER(c_ushort))
+    gamma.green = cast(c_void_p(address + size * C_USHORT_SIZE),
+                       POINTER(c_ushort))
+    gamma.blue = cast(c_void_p(address + 2 * size * C_USHORT_SIZE),
+                      POINTER(c_ushort))
+    return gamma
+
+
+# Linear interpolation taps, in 16-bit fixed point, for resampling a ramp of
+# source_size entries to size entries.
+def resample_taps(source_size, size):
+    taps = []
+
+    for j in range(size):
+        t = j * (source_size - 1) / (size - 1)
+        k = min(int(t), source_size - 2)
+        taps.append((k, int(round((t - k) * 65536))))
+
+    return tuple(taps)
+
+
+# Drives every active CRTC through its own gamma ramp. Ramps are generated
+# at the largest gamma size without a calibration. CRTCs are grouped by
+# gamma size and calibration; uncalibrated CRTCs of the largest size share
+# the submission buffer, and every other group gets one buffer that the
+# ramp is resampled and composed into. That happens in _prepare_outputs, so
+# that committing only issues the requests.
+#
+# Each CRTC is calibrated with the _ICC_PROFILE property of its outputs,
+# which is where profile loaders put the profile of each monitor; the root
+# window's _ICC_PROFILE only describes the primary output, so it is used
+# for the primary CRTC alone.
+class XRandRContext(X11Context):
+
+    ramp_ctype = c_ushort
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        display = self._display
+
+        try:
+            major = c_int()
+            minor = c_int()
+
+            if not XRRQueryVersion(display, byref(major), byref(minor)):
+                raise ContextError('X request failed: XRRQueryVersion')
+
+            if (major.value, minor.value) < (1, 2):
+                raise ContextError('XRandR 1.2 or newer is required')
+
+            crtcs = self._get_crtcs()
+
+            if not crtcs:
+                raise ContextError('No CRTC supports gamma ramps')
+
+            self.crtcs = [(crtc, size) for crtc, size, outputs in crtcs]
+            self._outputs = {crtc: outputs for crtc, size, outputs in crtcs}
+            self._primary_crtc = self._get_primary_crtc(
+                (major.value, minor.value))
+            self.ramp_size = max(size for crtc, size in self.crtcs)
+
+            self._allocate_ramp_buffer()
+
+            self._calibrations = None
+            self._groups = None
+            self.get_calibration_ramp()
+        except:
+            self._close_display()
+            raise
+
+        self._take_snapshot()
+
+    def _select_calibration_events(self, watch):
+        super()._select_calibration_events(watch)
+
+        event_base = c_int()
+        error_base = c_int()
+
+        if not XRRQueryExtension(watch, byref(event_base),
+                                 byref(error_base)):
+            raise ContextError('X request failed: XRRQueryExtension')
+
+        self._rr_notify = event_base.value + RRNotify
+
+        XRRSelectInput(watch, XRootWindow(watch, self._screen_num),
+                       RROutputPropertyNotifyMask)
+
+    def _is_calibration_event(self, event):
+        if event.type == self._rr_notify:
+            event = XRROutputPropertyNotifyEvent.from_buffer(event)
+
+            return (event.subtype == RRNotify_OutputProperty and
+                    event.property == self._icc_profile.value)
+
+        return super()._is_calibration_event(event)
+
+    def _get_crtcs(self):
+        display = self._display
+        resources = XRRGetScreenResources(display, self._root)
+
+        if not resources:
+            raise ContextError('X request failed: XRRGetScreenResources')
+
+        crtcs = []
+
+        try:
+            for i in range(resources.contents.ncrtc):
+                crtc = resources.contents.crtcs[i]
+                info = XRRGetCrtcInfo(display, resources, crtc)
+
+                if not info:
+                    continue
+
+                try:
+                    outputs = tuple(info.contents.outputs[j] for j in
+                                    range(info.contents.noutput))
+                finally:
+                    XRRFreeCrtcInfo(info)
+
+                size = XRRGetCrtcGammaSize(display, crtc)
+
+                if outputs and size > 1:
+                    crtcs.append((crtc, size, outputs))
+        finally:
+            XRRFreeScreenResources(resources)
+
+        return crtcs
+
+    # The CRTC of the primary output, or the first one where there is no
+    # primary output or the server predates XRandR 1.3; the request would
+    # fail there, and Xlib's default error handler exits.
+    def _get_primary_crtc(self, version):
+        if XRRGetOutputPrimary is not None and version >= (1, 3):
+            primary = XRRGetOutputPrimary(self._display, self._root)
+
+            for crtc, outputs in self._outputs.items():
+                if primary in outputs:
+                    return crtc
+
+        return self.crtcs[0][0]
+
+    def _read_output_calibration(self, output, size):
+        actual_type = XAtom()
+        actual_format = c_int()
+        nitems = c_ulong()
+        bytes_after = c_ulong()
+        data = c_uchar_p()
+
+        if XRRGetOutputProperty(self._display, output, self._icc_profile,
+                                0, MAX_PROPERTY_LENGTH, False, False,
+                                XA_CARDINAL, byref(actual_type),
+                                byref(actual_format), byref(nitems),
+                                byref(bytes_after), byref(data)) != XSuccess:
+            raise ContextError('X request failed: XRRGetOutputProperty')
+
+        return self._parse_calibration(data, nitems, bytes_after, size)
+
+    def _read_crtc_calibration(self, crtc, size):
+        for output in self._outputs[crtc]:
+            ramp = self._read_output_calibration(output, size)
+
+            if ramp is not None:
+                return ramp
+
+        if crtc == self._primary_crtc:
+            return self._read_calibration(size)
+
+        return None
+
+    # The calibrations are composed per CRTC in _prepare_outputs, so none
+    # is handed out for composition with the generated ramps. A change
+    # regroups the CRTCs and invalidates the fingerprint, as the generated
+    # ramp alone no longer tells whether the screen is up to date.
+    def get_calibration_ramp(self):
+        if not self._calibration_stale:
+            return None
+
+        self._calibration_stale = False
+
+        calibrations = {}
+
+        for crtc, size in self.crtcs:
+            ramp = self._read_crtc_calibration(crtc, size)
+            calibrations[crtc] = (Calibration(ramp) if ramp is not None
+                                  else None)
+
+        self.calibration_reads += 1
+
+        if calibrations != self._calibrations:
+            self._calibrations = calibrations
+            self._groups = self._make_groups(calibrations)
+            self._fingerprint_valid = False
+
+        return None
+
+    def _make_groups(self, calibrations):
+        members = {}
+
+        for crtc, size in self.crtcs:
+            members.setdefault((size, calibrations[crtc]), []).append(crtc)
+
+        groups = []
+
+        for (size, calibration), crtcs in sorted(
+                members.items(), key=lambda item: -item[0][0]):
+            if size == self.ramp_size and calibration is None:
+                buffer = self._ramp_buffer
+            else:
+                buffer = (c_ushort * size * 3)()
+
+            if size != self.ramp_size:
+                taps = resample_taps(self.ramp_size, size)
+            else:
+                taps = None
+
+            gamma = crtc_gamma(addressof(buffer), size)
+            groups.append((buffer, byref(gamma), gamma, taps, calibration,
+                           tuple(crtcs)))
+
+        return groups
+
+    def _get_crtc_ramp(self, crtc, size):
+        gamma = XRRGetCrtcGamma(self._display, crtc)
+
+        if not gamma:
+            raise ContextError('Unable to get gamma ramp')
+
+        try:
+            if gamma.contents.size != size:
+                raise ContextError('Unable to get gamma ramp')
+
+            ramp = Ramp(size, 'H')
+            view = memoryview(ramp)
+
+            for i, channel in enumerate((gamma.contents.red,
+                                         gamma.contents.green,
+                                         gamma.contents.blue)):
+                view[i * size:(i + 1) * size] = array(
+                    'H', channel[:size])
+
+            return ramp
+        finally:
+            XRRFreeGamma(gamma)
+
+    def get_ramp(self):
+        for crtc, size in self.crtcs:
+            if size == self.ramp_size:
+                return self._get_crtc_ramp(crtc, size)
+
+    # Every CRTC is captured and restored on its own; the snapshot is only
+    # kept if all of them look like undimmed ramps.
+    def _take_snapshot(self):
+        if not self.use_snapshot:
+            return
+
+        snapshots = []
+
+        try:
+            for crtc, size in self.crtcs:
+                ramp = self._get_crtc_ramp(crtc, size)
+
+                if not is_plausible(ramp):
+                    return
+
+                snapshots.append((crtc, ramp))
+        except (ContextError, AssertionError):
+            return
+
+        self._snapshots = snapshots
+        self.snapshot = next(ramp for crtc, ramp in snapshots
+                             if ramp.size == self.ramp_size)
+
+    def _restore_snapshot(self):
+        if self.snapshot is None:
+            return False
+
+        display = self._display
+
+        for crtc, ramp in self._snapshots:
+            gamma = crtc_gamma(ramp.buffer_info()[0], ramp.size)
+            XRRSetCrtcGamma(display, crtc, byref(gamma))
+
+        XFlush(display)
+
+        self.snapshot_restored = True
+        return True
+
+    def _resample(self, buffer, taps):
+        ramp_size = self.ramp_size
+        size = len(taps)
+        source = memoryview(self._ramp_buffer).cast('B').cast('H')
+        target = memoryview(buffer).cast('B').cast('H')
+
+        for i in range(3):
+            channel = source[i * ramp_size:(i + 1) * ramp_size]
+            target[i * size:(i + 1) * size] = array('H', [
+                channel[k] + ((channel[k + 1] - channel[k]) * w >> 16)
+                for k, w in taps])
+
+    def _prepare_outputs(self):
+        for buffer, gamma_ref, gamma, taps, calibration, members in \
+                self._groups:
+            if taps is not None:
+                self._resample(buffer, taps)
+            elif calibration is not None:
+                memmove(buffer, self._ramp_buffer, sizeof(buffer))
+
+            if calibration is not None:
+                calibration.compose(buffer)
+
+    # The requests of all CRTCs are queued back to back and the server is
+    # waited on until it has processed the last one. XRRSetCrtcGamma only
+    # queues a request, so the skew between outputs cannot be observed
+    # directly; it is bounded by the time from queuing the first request
+    # to the end of the round trip, which is what is returned.
+    def _commit_outputs(self):
+        display = self._display
+        start = time.perf_counter()
+
+        for buffer, gamma_ref, gamma, taps, calibration, members in \
+                self._groups:
+            for crtc in members:
+                XRRSetCrtcGamma(display, crtc, gamma_ref)
+
+        XSync(display, False)
+
+        return (start, time.perf_counter())
+
+    def _submit_ramp_buffer(self):
+        self._prepare_outputs()
+        self._commit_outputs()
+
+    def close(self):
+        try:
+            if self._restore_snapshot():
+                return
+
+            # the identity, composed with each CRTC's own calibration
+            ramp_size = self.ramp_size
+            ramp = (c_ushort * ramp_size * 3)()
+
+            for i in range(3):
+                for j in range(ramp_size):
+                    ramp[i][j] = C_USHORT_MAX * j // (ramp_size - 1)
+
+            self.get_calibration_ramp()
+            self._fill_ramp_buffer(ramp)
+            self._submit_ramp_buffer()
+        finally:
+            self._close_display()
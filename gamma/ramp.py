@@ -1,10 +1,162 @@
-__all__ = ['generate_ramp']
+import hashlib
+from array import array
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+__all__ = ['Calibration', 'Ramp', 'as_ramp', 'generate_ramp', 'pack_ramp']
+
+# Fractional bits of the fixed-point base curve and of the per-channel gain
+# used when packing straight into 16-bit buffers without NumPy.
+CURVE_BITS = 32
+GAIN_BITS = 16
+
+
+# A ramp stored as one contiguous array of three channels, either 16-bit
+# driver values ('H') or normalized floats ('f').
+class Ramp(array):
+
+    __slots__ = ('size',)
+
+    def __new__(cls, size, typecode='f', data=None):
+        assert size > 1
+        assert typecode in ('H', 'f')
+
+        if data is None:
+            data = bytes(3 * size * (2 if typecode == 'H' else 4))
+
+        self = super().__new__(cls, typecode, data)
+        self.size = size
+
+        assert len(self) == 3 * size
+
+        return self
+
+    def __reduce_ex__(self, protocol):
+        return (Ramp, (self.size, self.typecode, self.tobytes()))
+
+    def __copy__(self):
+        return Ramp(self.size, self.typecode, self.tobytes())
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    def channel(self, i):
+        size = self.size
+        return memoryview(self)[i * size:(i + 1) * size]
+
+    def channels(self):
+        return tuple(self.channel(i) for i in range(3))
+
+
+# A calibration ramp prepared once for composition with generated ramps:
+# a generated value y of channel i is replaced by the calibration curve of
+# that channel evaluated at y, interpolating linearly between its samples.
+class Calibration:
+
+    def __init__(self, ramp):
+        assert isinstance(ramp, Ramp)
+
+        ramp = as_ramp(ramp, ramp.size)
+
+        self.size = ramp.size
+        self.digest = hashlib.sha1(ramp.tobytes()).digest()
+
+        if np is not None:
+            self._x = np.linspace(0.0, 1.0, ramp.size)
+            self._curves = np.asarray(memoryview(ramp)).reshape(
+                3, ramp.size).astype(np.float64)
+            self._curves.flags.writeable = False
+        else:
+            self._segments = tuple(_segments(channel)
+                                   for channel in ramp.channels())
+
+    def __eq__(self, other):
+        return (isinstance(other, Calibration) and
+                self.digest == other.digest)
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def apply_numpy(self, i, channel):
+        channel[:] = np.interp(channel, self._x, self._curves[i])
+
+    def apply_python(self, i, channel):
+        segments = self._segments[i]
+        n = len(segments) - 1
+        result = []
+
+        for y in channel:
+            t = y * n
+            j = int(t)
+            y0, dy = segments[j]
+            result.append(y0 + dy * (t - j))
+
+        return result
+
+    # Composes a packed ramp of the calibration's size with the calibration
+    # in place, for ramps that were generated without it.
+    def compose(self, out):
+        size = self.size
+
+        if np is not None:
+            view = np.asarray(memoryview(out)).reshape(3, size)
+            ramp = view.astype(np.float64)
+            scale = 1.0 if view.dtype.kind == 'f' else np.iinfo(view.dtype).max
+            ramp /= scale
+
+            for i in range(3):
+                self.apply_numpy(i, ramp[i])
+
+            ramp *= scale
+            np.copyto(view, ramp, casting='unsafe')
+            return out
+
+        view = memoryview(out).cast('B')
+
+        if view.nbytes == 3 * size * 4:
+            view = view.cast('f')
+            scale = 1.0
+        else:
+            view = view.cast('H')
+            scale = 65535
+
+        return pack_ramp(tuple(
+            self.apply_python(i, [y / scale for y in
+                                  view[i * size:(i + 1) * size]])
+            for i in range(3)), out)
+
+
+# (value, slope) per sample; the last sample repeats with zero slope so that
+# y == 1.0 needs no special case.
+def _segments(channel):
+    values = [float(y) for y in channel]
+    segments = [(values[j], values[j + 1] - values[j])
+                for j in range(len(values) - 1)]
+    segments.append((values[-1], 0.0))
+    return tuple(segments)
+
+
+def as_ramp(ramp, size, typecode='f'):
+    if (isinstance(ramp, Ramp) and ramp.size == size and
+            ramp.typecode == typecode):
+        return ramp
+
+    return pack_ramp(ramp, Ramp(size, typecode))
 
 
 def generate_ramp(size=256, gamma=1.0, brightness=0.0, contrast=1.0,
-                  temperature=6500, minimum=0.0, maximum=1.0):
+                  temperature=6500, minimum=0.0, maximum=1.0, out=None,
+                  typecode='f', calibration=None):
     assert size > 1
 
+    if out is None:
+        out = Ramp(size, typecode)
+
     if not isinstance(gamma, (tuple, list)):
         gamma = (gamma, gamma, gamma)
 
@@ -28,10 +180,107 @@ def generate_ramp(size=256, gamma=1.0, brightness=0.0, contrast=1.0,
     else:
         whitepoint = temperature
 
-    ramp = ([0] * size, [0] * size, [0] * size)
+    if np is not None:
+        return _generate_ramp_numpy(size, gamma, brightness, contrast,
+                                    whitepoint, minimum, maximum, out,
+                                    calibration)
+
+    if calibration is None and memoryview(out).nbytes == 3 * size * 2:
+        _generate_ramp_fixed(size, gamma, brightness, contrast, whitepoint,
+                             minimum, maximum, out)
+        return out
+
+    ramp = _generate_ramp_python(size, gamma, brightness, contrast,
+                                 whitepoint, minimum, maximum)
+
+    if calibration is not None:
+        ramp = tuple(calibration.apply_python(i, ramp[i]) for i in range(3))
+
+    return pack_ramp(ramp, out)
+
+
+# The power curve is the only transcendental term of a ramp and depends on
+# gamma and size alone; everything else is a cheap affine pass on top of it.
+@lru_cache(maxsize=32)
+def base_curve(gamma, size):
+    if np is not None:
+        x = np.arange(size, dtype=np.float64) / (size - 1)
+        curve = np.power(x, gamma)
+        curve.flags.writeable = False
+        return curve
+
+    return tuple(pow(j / (size - 1), gamma) for j in range(size))
+
+
+def _generate_ramp_python(size, gamma, brightness, contrast, whitepoint,
+                          minimum, maximum):
+    ramp = [None, None, None]
+
+    for i in range(3):
+        c = contrast[i] * whitepoint[i]
+        b = brightness[i]
+        s = maximum[i] - minimum[i]
+        t = minimum[i]
+        m = min(maximum[i], 1.0)
+        n = max(minimum[i], 0.0)
+
+        channel = [(b + c * x) * s + t for x in base_curve(gamma[i], size)]
+        channel = [n if y < n else m if y > m else y for y in channel]
+        channel[0] = min(max(b * s + t, n), m)
+
+        ramp[i] = channel
+
+    return tuple(ramp)
+
+
+@lru_cache(maxsize=32)
+def base_curve_fixed(gamma, size):
+    one = 1 << CURVE_BITS
+    return tuple(int(pow(j / (size - 1), gamma) * one + 0.5)
+                 for j in range(size))
+
+
+# Writes 16-bit values straight into out without building float lists.
+#
+# The float path stores int(65535 * clamp(y)) with y = (b + c * x) * s + t.
+# Here 65535 * y is evaluated as (offset + gain * x) >> (CURVE_BITS +
+# GAIN_BITS) on Python integers, with x, gain and offset rounded to that
+# many fractional bits, and clamped to [int(65535 * n), int(65535 * m)].
+# Flooring and clamping commute for integer bounds and y >= 0 after the
+# clamp, so both paths produce the same value except when 65535 * y lies
+# within about 1e-5 of an integer, where the result may differ by 1 LSB.
+def _generate_ramp_fixed(size, gamma, brightness, contrast, whitepoint,
+                         minimum, maximum, out):
+    view = memoryview(out).cast('B').cast('H')
+    shift = CURVE_BITS + GAIN_BITS
+
+    for i in range(3):
+        c = contrast[i] * whitepoint[i]
+        b = brightness[i]
+        s = maximum[i] - minimum[i]
+        t = minimum[i]
+        hi = min(maximum[i], 1.0)
+        lo = max(minimum[i], 0.0)
+        m = int(65535 * hi)
+        n = int(65535 * lo)
+
+        offset = int(round((b * s + t) * 65535 * (1 << shift)))
+        gain = int(round(c * s * 65535 * (1 << GAIN_BITS)))
+
+        channel = [(offset + gain * x) >> shift
+                   for x in base_curve_fixed(gamma[i], size)]
+        channel = array('H', [n if y < n else m if y > m else y
+                              for y in channel])
+        channel[0] = int(65535 * min(max(b * s + t, lo), hi))
+
+        view[i * size:(i + 1) * size] = channel
+
+
+def _generate_ramp_numpy(size, gamma, brightness, contrast, whitepoint,
+                         minimum, maximum, out, calibration=None):
+    ramp = np.empty((3, size), dtype=np.float64)
 
     for i in range(3):
-        g = gamma[i]
         c = contrast[i] * whitepoint[i]
         b = brightness[i]
         s = maximum[i] - minimum[i]
@@ -39,17 +288,57 @@ def generate_ramp(size=256, gamma=1.0, brightness=0.0, contrast=1.0,
         m = min(maximum[i], 1.0)
         n = max(minimum[i], 0.0)
 
-        ramp[i][0] = min(max(b * s + t, n), m)
+        channel = ramp[i]
+        np.multiply(base_curve(gamma[i], size), c, out=channel)
+        channel += b
+        channel *= s
+        channel += t
+        channel[0] = b * s + t
+        np.clip(channel, n, m, out=channel)
+
+        if calibration is not None:
+            calibration.apply_numpy(i, channel)
 
-        for j in range(1, size):
-            ramp[i][j] = (b + c * pow(j / (size - 1), g)) * s + t
+    view = np.asarray(memoryview(out)).reshape(3, size)
+
+    if view.dtype.kind != 'f':
+        ramp *= np.iinfo(view.dtype).max
+
+    np.copyto(view, ramp, casting='unsafe')
+    return out
+
+
+def pack_ramp(ramp, out):
+    view = memoryview(out).cast('B')
+
+    if isinstance(ramp, Ramp):
+        size = ramp.size
+
+        if view.nbytes == ramp.itemsize * 3 * size:
+            view[:] = memoryview(ramp).cast('B')
+            return out
+
+        if ramp.typecode == 'H':
+            ramp = [[y / 65535 for y in channel]
+                    for channel in ramp.channels()]
+        else:
+            ramp = ramp.channels()
+    else:
+        size = len(ramp[0])
+
+    if view.nbytes == 3 * size * 4:
+        view = view.cast('f')
+
+        for i in range(3):
+            view[i * size:(i + 1) * size] = array('f', ramp[i])
+    else:
+        view = view.cast('H')
 
-            if ramp[i][j] < n:
-                ramp[i][j] = n
-            elif ramp[i][j] > m:
-                ramp[i][j] = m
+        for i in range(3):
+            view[i * size:(i + 1) * size] = array(
+                'H', [int(65535 * y) for y in ramp[i]])
 
-    return ramp
+    return out
 
 
 def to_whitepoint(temperature):
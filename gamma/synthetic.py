@@ -0,0 +1,111 @@
+import struct
+
+
+__all__ = ['PROFILES', 'large', 'mlut', 'ms00', 'ms00_hdr', 'profile',
+           'table', 'vcgt_formula', 'vcgt_table', 'vcgt_table_tag']
+
+# Synthetic ICC profiles with one calibration tag each, for the benchmarks
+# and the tests. Only the parts read_icc_ramp looks at are filled in.
+
+CDM = 'http://schemas.microsoft.com/windows/2005/02/color/ColorDeviceModel'
+CAL = 'http://schemas.microsoft.com/windows/2007/11/color/Calibration'
+WCS = ('http://schemas.microsoft.com/windows/2005/02/color/'
+       'WcsCommonProfileTypes')
+
+
+def tag(name):
+    return struct.unpack('>I', name)[0]
+
+
+def profile(tags):
+    header = bytearray(128)
+    header[16:20] = b'RGB '
+
+    offset = 132 + 12 * len(tags)
+    table = [struct.pack('>I', len(tags))]
+    data = []
+
+    for name, payload in tags:
+        table.append(struct.pack('>III', tag(name), offset, len(payload)))
+        data.append(payload)
+        offset += len(payload)
+
+    return bytes(header) + b''.join(table) + b''.join(data)
+
+
+# The three channels of a power curve table with one gamma per channel.
+def table(gamma, entries=256, scale=65535):
+    return [min(scale, int(scale * (j / (entries - 1)) ** gamma[i]))
+            for i in range(3) for j in range(entries)]
+
+
+def vcgt_table_tag(gamma=(0.9, 1.0, 1.1), entries=256, entry_size=2):
+    return (struct.pack('>III', tag(b'vcgt'), 0, 0) +
+            struct.pack('>HHH', 3, entries, entry_size) +
+            struct.pack('>{}{}'.format(3 * entries, 'BH'[entry_size - 1]),
+                        *table(gamma, entries, 256 ** entry_size - 1)))
+
+
+def vcgt_table(gamma=(0.9, 1.0, 1.1), entries=256, entry_size=2):
+    return profile([(b'vcgt', vcgt_table_tag(gamma, entries, entry_size))])
+
+
+def vcgt_formula(values=(1.1, 0.0, 1.0, 1.0, 0.0, 0.98, 0.9, 0.01, 1.0)):
+    return profile([(b'vcgt', struct.pack('>III', tag(b'vcgt'), 0, 1) +
+                     struct.pack('>9I', *[int(65536 * v) for v in values]))])
+
+
+def mlut(gamma=(1.05, 1.0, 0.95)):
+    return profile([(b'mLUT', struct.pack('>768H', *table(gamma)))])
+
+
+def _ms00(calibration):
+    xml = ('<cdm:ColorDeviceModel xmlns:cdm="{}" xmlns:cal="{}" '
+           'xmlns:wcs="{}"><cdm:Calibration>'
+           '<cal:AdapterGammaConfiguration>{}'
+           '</cal:AdapterGammaConfiguration>'
+           '</cdm:Calibration></cdm:ColorDeviceModel>').format(
+               CDM, CAL, WCS, calibration).encode()
+
+    return profile([(b'MS00', struct.pack('>4I', tag(b'MS10'), 0, 16,
+                                          len(xml)) + xml)])
+
+
+def ms00():
+    return _ms00('<cal:ParameterizedCurves>'
+                 '<wcs:RedTRC Gamma="1.1" Gain="1.0" Offset1="0.0"/>'
+                 '<wcs:GreenTRC Gamma="1.0"/>'
+                 '<wcs:BlueTRC Gamma="0.9" TransitionPoint="0.02" '
+                 'Offset3="0.0"/>'
+                 '</cal:ParameterizedCurves>')
+
+
+# inputs and outputs are three sequences of equal length, one per channel.
+def ms00_hdr(inputs, outputs):
+    curves = ''.join(
+        '<wcs:{0}TRC><wcs:Input>{1}</wcs:Input><wcs:Output>{2}</wcs:Output>'
+        '</wcs:{0}TRC>'.format(name, ' '.join(map(repr, x)),
+                               ' '.join(map(repr, y)))
+        for name, x, y in zip(('Red', 'Green', 'Blue'), inputs, outputs))
+
+    return _ms00('<cal:HDRToneResponseCurves TRCLength="{}">{}'
+                 '</cal:HDRToneResponseCurves>'.format(len(inputs[0]),
+                                                       curves))
+
+
+# a vcgt table behind 1 MiB of unrelated tags, as written by profilers that
+# embed measurement data
+def large():
+    blob = bytes(1 << 14)
+    return profile([(b'z%03d' % i, blob) for i in range(64)] +
+                   [(b'vcgt', vcgt_table_tag())])
+
+
+# name: (builder, system the profile is read on)
+PROFILES = {
+    'vcgt-table': (vcgt_table, None),
+    'vcgt-formula': (vcgt_formula, None),
+    'mLUT': (mlut, None),
+    'MS00': (ms00, 'Windows'),
+    'large': (large, None),
+}
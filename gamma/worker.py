@@ -0,0 +1,74 @@
+import threading
+import traceback
+
+
+__all__ = ['Worker']
+
+
+# Calls func on a dedicated thread with the most recently posted value.
+# The mailbox holds a single value: posting while func is busy replaces the
+# pending value, so a burst collapses into one call with the newest one.
+class Worker:
+
+    def __init__(self, func, name=None):
+        self.posted = 0
+        self.processed = 0
+        self.coalesced = 0
+
+        self._func = func
+        self._cond = threading.Condition()
+        self._value = None
+        self._pending = False
+        self._busy = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name,
+                                        daemon=True)
+        self._thread.start()
+
+    def post(self, value):
+        with self._cond:
+            assert not self._closed
+
+            if self._pending:
+                self.coalesced += 1
+
+            self._value = value
+            self._pending = True
+            self.posted += 1
+            self._cond.notify_all()
+
+    def wait(self):
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+
+                if not self._pending:
+                    return
+
+                value = self._value
+                self._value = None
+                self._pending = False
+                self._busy = True
+
+            try:
+                self._func(value)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self.processed += 1
+                    self._cond.notify_all()
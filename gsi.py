@@ -0,0 +1,233 @@
+import json
+import struct
+import time
+import zlib
+
+
+__all__ = ['SessionRecorder', 'extract', 'parse_state', 'read_session',
+           'select_state']
+
+MAGIC = b'GSIR'
+VERSION = 1
+
+# magic, version, wall-clock time at which recording started
+HEADER = struct.Struct('<4sId')
+# nanoseconds since recording started, payload length | COMPRESSED
+FRAME = struct.Struct('<QI')
+
+COMPRESSED = 1 << 31
+
+
+# Appends GSI payloads to a session log. Frames are packed into a buffer of
+# buffer_size bytes that is allocated once and written out with a single
+# unbuffered write whenever the next frame does not fit; a frame larger
+# than the buffer is written directly. With compress, all payloads go
+# through one deflate stream that is sync-flushed after every frame, so
+# that each frame can refer back to the previous ones; successive updates
+# differ in a few fields only, and a per-frame zlib.compress would cost
+# more than parsing the payload.
+class SessionRecorder:
+
+    def __init__(self, path, buffer_size=1 << 16, compress=False):
+        assert buffer_size >= FRAME.size
+
+        self.path = path
+        self.compress = compress
+        self._compressor = zlib.compressobj(1) if compress else None
+        self.frames = 0
+        self.payload_bytes = 0
+        self.written_bytes = 0
+
+        self._file = open(path, mode='wb', buffering=0)
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._offset = 0
+        self._start = time.monotonic_ns()
+
+        self._append(HEADER.pack(MAGIC, VERSION, time.time()))
+
+    def record(self, payload, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+
+        length = len(payload)
+        self.payload_bytes += length
+
+        if self._compressor is not None:
+            payload = (self._compressor.compress(payload) +
+                       self._compressor.flush(zlib.Z_SYNC_FLUSH))
+            length = len(payload) | COMPRESSED
+
+        frame_size = FRAME.size + len(payload)
+
+        if self._offset + frame_size > len(self._buffer):
+            self.flush()
+
+        if frame_size > len(self._buffer):
+            self._append(FRAME.pack(timestamp - self._start, length))
+            self._append(payload)
+        else:
+            offset = self._offset
+            FRAME.pack_into(self._buffer, offset, timestamp - self._start,
+                            length)
+            offset += FRAME.size
+            self._view[offset:offset + len(payload)] = payload
+            self._offset = offset + len(payload)
+
+        self.frames += 1
+
+    def _append(self, data):
+        if self._offset + len(data) > len(self._buffer):
+            self.flush()
+            self._write(data)
+        else:
+            self._view[self._offset:self._offset + len(data)] = data
+            self._offset += len(data)
+
+    def _write(self, data):
+        view = memoryview(data)
+
+        while view:
+            view = view[self._file.write(view):]
+
+        self.written_bytes += len(data)
+
+    def flush(self):
+        if self._offset:
+            self._write(self._view[:self._offset])
+            self._offset = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._view.release()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+# Yields (seconds since recording started, payload) for every frame of a
+# session log; a truncated last frame is ignored.
+def read_session(path):
+    with open(path, mode='rb') as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise ValueError('Not a session log: {}'.format(path))
+
+    magic, version, _ = HEADER.unpack_from(data)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a session log: {}'.format(path))
+
+    offset = HEADER.size
+    decompressor = zlib.decompressobj()
+
+    while offset + FRAME.size <= len(data):
+        timestamp, length = FRAME.unpack_from(data, offset)
+        offset += FRAME.size
+        size = length & ~COMPRESSED
+
+        if offset + size > len(data):
+            return
+
+        payload = data[offset:offset + size]
+        offset += size
+
+        if length & COMPRESSED:
+            payload = decompressor.decompress(payload)
+
+        yield timestamp / 1e9, payload
+
+
+def extract(data, *keys, default=None):
+    for key in keys:
+        if not isinstance(data, dict) or key not in data:
+            return default
+        data = data[key]
+    return data
+
+
+# The values the app uses: provider steamid and timestamp, round phase,
+# player steamid and the flashed and smoked levels.
+def parse_state(data):
+    return (extract(data, 'provider', 'steamid'),
+            extract(data, 'provider', 'timestamp'),
+            extract(data, 'round', 'phase'),
+            extract(data, 'player', 'steamid'),
+            extract(data, 'player', 'state', 'flashed', default=0),
+            extract(data, 'player', 'state', 'smoked', default=0))
+
+
+# CS:GO writes its payloads pretty-printed with one tab per level, and JSON
+# strings cannot contain raw newlines, so a member at depth n is the only
+# place where a newline is followed by n tabs and a quote. That allows
+# going straight to the provider, round and player members and decoding
+# only the values parse_state reads with raw_decode, instead of the whole
+# payload with its map, weapons and match stats. Returns None if the
+# payload is not laid out like that.
+def select_state(body):
+    if not body.startswith((b'{\n\t"', b'{\r\n\t"')):
+        return None
+
+    # the first member shows whether keys are followed by ': '
+    line_end = body.find(b'\n', 3)
+
+    if line_end < 0 or b'": ' not in body[3:line_end]:
+        return None
+
+    try:
+        provider = _section(body, b'provider')
+        round_ = _section(body, b'round')
+        player = _section(body, b'player')
+        state = _value(player, 'state')
+
+        if isinstance(state, dict):
+            flashed = state.get('flashed', 0)
+            smoked = state.get('smoked', 0)
+        else:
+            flashed = smoked = 0
+
+        return (_value(provider, 'steamid'),
+                _value(provider, 'timestamp'),
+                _value(round_, 'phase'),
+                _value(player, 'steamid'),
+                flashed, smoked)
+    except ValueError:
+        return None
+
+
+_decoder = json.JSONDecoder()
+
+
+# Returns the value of the top-level member key as text, which ends where
+# the next top-level member starts.
+def _section(body, key):
+    i = body.find(b'\n\t"' + key + b'": ')
+
+    if i < 0:
+        return None
+
+    i += len(key) + 6
+    j = body.find(b'\n\t"', i)
+
+    return body[i:j if j >= 0 else len(body)].decode('utf-8')
+
+
+# Decodes the member key of a top-level member's value.
+def _value(section, key):
+    if section is None:
+        return None
+
+    pattern = '\n\t\t"' + key + '": '
+    i = section.find(pattern)
+
+    if i < 0:
+        return None
+
+    return _decoder.raw_decode(section, i + len(pattern))[0]
@@ -0,0 +1,171 @@
+import bisect
+import threading
+from collections import deque
+
+
+__all__ = ['Histogram', 'Metrics', 'Tracer']
+
+# Bucket upper bounds in seconds, from 1 us to 100 ms.
+BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3,
+           2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 1e-1)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+# A histogram with fixed buckets; observing a value is a bisect and two
+# additions. Every histogram is only observed from a single thread.
+class Histogram:
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        count = 0
+
+        for bound, n in zip(self.buckets, self.counts):
+            count += n
+            lines.append('{}_bucket{{le="{!r}"}} {}'.format(self.name, bound,
+                                                            count))
+
+        count += self.counts[-1]
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, count))
+        lines.append('{}_sum {!r}'.format(self.name, self.sum))
+        lines.append('{}_count {}'.format(self.name, count))
+
+        return lines
+
+
+# The stages of a GSI update, from the POST body to the driver call, plus
+# counters that are read from their owners when the metrics are scraped.
+class Metrics:
+
+    PREFIX = 'dont_blind_me_'
+
+    def __init__(self):
+        def histogram(name, help):
+            return Histogram(self.PREFIX + name + '_seconds', help)
+
+        self.decode = histogram('decode', 'Time to decode a GSI payload')
+        self.diff = histogram('diff', 'Time to diff the game state')
+        self.generate = histogram('generate', 'Time to look up or generate '
+                                  'a ramp')
+        self.pack = histogram('pack', 'Time to pack a ramp into the '
+                              'submission buffer')
+        self.submit = histogram('submit', 'Time spent in the driver call')
+        self.requests = 0
+        self.driver_errors = 0
+        self.counters = []
+        self.tracer = Tracer()
+
+    # func is called at scrape time and returns the current value.
+    def counter(self, name, help, func):
+        self.counters.append((self.PREFIX + name + '_total', help, func))
+
+    def histograms(self):
+        return (self.decode, self.diff, self.generate, self.pack,
+                self.submit)
+
+    def expose(self):
+        lines = []
+
+        for name, help, func in self.counters:
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} counter'.format(name))
+            lines.append('{} {}'.format(name, func()))
+
+        for histogram in self.histograms():
+            lines.extend(histogram.expose())
+
+        lines.extend(self.tracer.expose())
+
+        return '\n'.join(lines) + '\n'
+
+
+# Follows GSI updates that reach the screen. The receive to commit latency
+# is measured with perf_counter; the age of an update at commit time is
+# measured against provider.timestamp, which has a resolution of one
+# second. Both are kept over a rolling window of the last window updates;
+# updates beyond the outlier thresholds are logged.
+class Tracer:
+
+    def __init__(self, window=1024, max_latency=0.05, max_age=2.0):
+        self.max_latency = max_latency
+        self.max_age = max_age
+        self.traced = 0
+        self.outliers = 0
+
+        self._latencies = deque(maxlen=window)
+        self._ages = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    # trace is (provider timestamp or None, receive time.time(), receive
+    # perf_counter); committed is the perf_counter after the driver call.
+    def record(self, trace, committed):
+        provider_timestamp, received_wall, received = trace
+        latency = committed - received
+
+        if provider_timestamp is not None:
+            age = received_wall + latency - provider_timestamp
+        else:
+            age = None
+
+        with self._lock:
+            self._latencies.append(latency)
+
+            if age is not None:
+                self._ages.append(age)
+
+            self.traced += 1
+
+        if latency > self.max_latency or (age is not None and
+                                          age > self.max_age):
+            self.outliers += 1
+
+            print('Slow update: {:.1f} ms from receive to screen, {} since '
+                  'the game sent it'.format(
+                      latency * 1e3, 'unknown' if age is None else
+                      '{:.1f} s'.format(age)))
+
+    def percentiles(self, quantiles=QUANTILES):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            ages = sorted(self._ages)
+
+        return ([(q, quantile(latencies, q)) for q in quantiles],
+                [(q, quantile(ages, q)) for q in quantiles])
+
+    def expose(self):
+        latencies, ages = self.percentiles()
+        lines = []
+
+        for name, help, values in (
+                ('receive_to_commit_seconds', 'Time from receiving a GSI '
+                 'update to committing its ramp', latencies),
+                ('provider_to_commit_seconds', 'Age of a GSI update, by '
+                 'provider.timestamp, when its ramp is committed', ages)):
+            name = Metrics.PREFIX + name
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} summary'.format(name))
+
+            for q, value in values:
+                lines.append('{}{{quantile="{!r}"}} {!r}'.format(name, q,
+                                                                  value))
+
+        return lines
+
+
+def quantile(values, q):
+    if not values:
+        return float('nan')
+
+    return values[min(int(q * len(values)), len(values) - 1)]
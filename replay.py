@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from aiohttp import ClientSession, web
+from gsi import read_session
+from metrics import quantile
+
+
+# Replays the frames of a session as one virtual client. With speed > 0 the
+# original spacing of the frames is kept, compressed by speed; with speed 0
+# they are sent back to back.
+async def run_client(frames, send, speed, latencies):
+    start = time.perf_counter()
+
+    for timestamp, payload in frames:
+        if speed > 0:
+            delay = start + timestamp / speed - time.perf_counter()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        t = time.perf_counter()
+        await send(payload)
+        latencies.append(time.perf_counter() - t)
+
+
+async def replay(frames, send, clients, speed):
+    latencies = []
+
+    t = time.perf_counter()
+
+    await asyncio.gather(*[run_client(frames, send, speed, latencies)
+                           for _ in range(clients)])
+
+    return time.perf_counter() - t, sorted(latencies)
+
+
+async def main(args):
+    frames = list(read_session(args.session))
+
+    if frames:
+        first = frames[0][0]
+        frames = [(timestamp - first, payload)
+                  for timestamp, payload in frames]
+
+    app = None
+    runner = None
+
+    if args.url is None:
+        # imported here so that replaying against a running app does not
+        # need the gamma package
+        os.environ.setdefault('DONT_BLIND_ME_CONTEXT', 'null')
+
+        from app import App
+
+        directory = tempfile.TemporaryDirectory(prefix='replay-')
+        app = App(path=directory.name)
+        app.update_brightness(force=True)
+
+        # the provider timestamps of a recorded session are in the past
+        app.metrics.tracer.max_age = float('inf')
+
+    if args.direct:
+        # the same steps as App.handle for a POST
+        async def send(payload):
+            app.metrics.requests += 1
+
+            received = time.perf_counter()
+            received_wall = time.time()
+
+            if app.handle_state(payload):
+                app.trace = (app.provider_timestamp, received_wall, received)
+                app.update_brightness()
+
+        elapsed, latencies = await replay(frames, send, args.clients,
+                                          args.speed)
+    else:
+        if args.url is None:
+            runner = web.AppRunner(app.make_app())
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', 0).start()
+            host, port = runner.addresses[0][:2]
+            url = 'http://{}:{}/'.format(host, port)
+        else:
+            url = args.url
+
+        async with ClientSession() as session:
+            async def send(payload):
+                async with session.post(url, data=payload, headers={
+                        'Content-Type': 'application/json'}) as response:
+                    await response.read()
+                    assert response.status == 200
+
+            elapsed, latencies = await replay(frames, send, args.clients,
+                                              args.speed)
+
+        if runner is not None:
+            await runner.cleanup()
+
+    requests = len(latencies)
+
+    print('{} requests from {} clients in {:.3f} s: {:.0f} requests/s'.format(
+          requests, args.clients, elapsed, requests / max(elapsed, 1e-9)))
+    print('latency (ms): p50 {:.3f}  p90 {:.3f}  p99 {:.3f}  '
+          'max {:.3f}'.format(*(quantile(latencies, q) * 1e3
+                                for q in (0.5, 0.9, 0.99, 1.0))))
+
+    if app is not None:
+        app.worker.wait()
+
+        print('ramp updates: {} posted, {} coalesced; submissions: {} issued, '
+              '{} skipped as unchanged'.format(
+                  app.worker.posted, app.worker.coalesced,
+                  app.context.submissions, app.context.skipped_submissions))
+
+        app.close()
+        directory.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Replay a recorded GSI session against the app.')
+    parser.add_argument('session', help='session log recorded by the app')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='time warp factor; 0 sends as fast as possible')
+    parser.add_argument('--clients', type=int, default=1,
+                        help='number of concurrent virtual clients')
+    parser.add_argument('--url', help='endpoint of a running app; by '
+                        'default an app with a null context is started '
+                        'in process')
+    parser.add_argument('--direct', action='store_true',
+                        help='call the handler directly instead of going '
+                        'through HTTP')
+
+    args = parser.parse_args()
+
+    if args.direct and args.url is not None:
+        parser.error('--direct cannot be combined with --url')
+
+    asyncio.get_event_loop().run_until_complete(main(args))
@@ -0,0 +1,149 @@
+import io
+import itertools
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from gamma import calibration as calibration_module
+from gamma import read_icc_ramp
+from gamma.synthetic import (PROFILES, ms00_hdr, profile, table,
+                             vcgt_table)
+
+
+SIZES = (2, 100, 256, 1024, 4096)
+
+
+def without_numpy():
+    return mock.patch.object(calibration_module, 'np', None)
+
+
+# Linear interpolation of a uniform table at size evenly spaced points,
+# written out independently of both resamplers.
+def interpolate(values, size):
+    n = len(values)
+    result = []
+
+    for j in range(size):
+        position = j / (size - 1) * (n - 1)
+        k = min(int(position), n - 2)
+        result.append(values[k] + (values[k + 1] - values[k]) *
+                      (position - k))
+
+    return result
+
+
+# Linear interpolation of (xs, ys) at size evenly spaced points, holding the
+# end values outside of xs.
+def interpolate_xy(xs, ys, size):
+    result = []
+
+    for j in range(size):
+        x = j / (size - 1)
+
+        if x <= xs[0]:
+            result.append(ys[0])
+        elif x >= xs[-1]:
+            result.append(ys[-1])
+        else:
+            k = next(k for k in range(len(xs) - 1) if x < xs[k + 1])
+            result.append(ys[k] + (ys[k + 1] - ys[k]) * (x - xs[k]) /
+                          (xs[k + 1] - xs[k]))
+
+    return result
+
+
+class ReadICCRampTest(unittest.TestCase):
+
+    def assertRampAlmostEqual(self, ramp, channels, tolerance=1e-6):
+        for i, channel in enumerate(ramp.channels()):
+            self.assertEqual(len(channel), len(channels[i]))
+            self.assertLessEqual(max(abs(x - y) for x, y in
+                                     zip(channel, channels[i])), tolerance)
+
+    def test_inputs(self):
+        data = PROFILES['vcgt-table'][0]()
+        expected = read_icc_ramp(data, size=1024).tobytes()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'profile.icc')
+
+            with open(path, mode='wb') as f:
+                f.write(data)
+
+            with open(path, mode='rb') as f:
+                self.assertEqual(read_icc_ramp(f, size=1024).tobytes(),
+                                 expected)
+
+        for source in (memoryview(data), bytearray(data), io.BytesIO(data)):
+            with self.subTest(type(source).__name__):
+                self.assertEqual(read_icc_ramp(source, size=1024).tobytes(),
+                                 expected)
+
+    def test_resample_vcgt_table(self):
+        for entries, entry_size, size in itertools.product(
+                (16, 256, 1024), (1, 2), SIZES):
+            gamma = (0.8, 1.0, 1.3)
+            scale = 256 ** entry_size - 1
+            values = table(gamma, entries, scale)
+            expected = [interpolate([v / scale for v in
+                                     values[i * entries:(i + 1) * entries]],
+                                    size) for i in range(3)]
+            data = vcgt_table(gamma, entries, entry_size)
+
+            with self.subTest(entries=entries, entry_size=entry_size,
+                              size=size):
+                self.assertRampAlmostEqual(read_icc_ramp(data, size=size),
+                                           expected)
+
+                with without_numpy():
+                    self.assertRampAlmostEqual(
+                        read_icc_ramp(data, size=size), expected)
+
+    def test_resample_hdr_curves(self):
+        # the blue curve starts and ends inside [0, 1]
+        inputs = [(0.0, 0.25, 1.0), (0.0, 0.5, 1.0), (0.1, 0.5, 0.9)]
+        outputs = [(0.0, 0.2, 1.0), (0.05, 0.4, 0.95), (0.0, 0.3, 1.0)]
+
+        data = ms00_hdr(inputs, outputs)
+
+        for size in SIZES:
+            expected = [interpolate_xy(x, y, size)
+                        for x, y in zip(inputs, outputs)]
+
+            with self.subTest(size=size):
+                self.assertRampAlmostEqual(
+                    read_icc_ramp(data, size=size, system='Windows'),
+                    expected)
+
+                with without_numpy():
+                    self.assertRampAlmostEqual(
+                        read_icc_ramp(data, size=size, system='Windows'),
+                        expected)
+
+    def test_identity_without_calibration(self):
+        data = profile([(b'desc', bytes(16))])
+        expected = [[j / 255 for j in range(256)]] * 3
+
+        self.assertRampAlmostEqual(read_icc_ramp(data, size=256), expected)
+
+    @unittest.skipIf(calibration_module.np is None, 'NumPy is not installed')
+    def test_numpy_parity(self):
+        for (name, (make, system)), size, typecode in itertools.product(
+                PROFILES.items(), SIZES, ('f', 'H')):
+            data = make()
+            expected = read_icc_ramp(data, size=size, system=system,
+                                     typecode=typecode)
+
+            with without_numpy():
+                actual = read_icc_ramp(data, size=size, system=system,
+                                       typecode=typecode)
+
+            with self.subTest(name=name, size=size, typecode=typecode):
+                self.assertLessEqual(max(abs(x - y) for x, y in
+                                         zip(expected, actual)),
+                                     1 if typecode == 'H' else 1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
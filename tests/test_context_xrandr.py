@@ -0,0 +1,225 @@
+import os
+import shutil
+import subprocess
+import time
+import unittest
+from ctypes import c_int, c_ubyte, c_ushort
+from unittest import mock
+
+from gamma import Calibration, ContextError, generate_ramp, read_icc_ramp
+from gamma.synthetic import vcgt_table
+
+try:
+    from gamma.context_x11 import (X11, XA_CARDINAL, XAtom, XCloseDisplay,
+                                   XDefaultScreen, XInternAtom, XOpenDisplay,
+                                   XRootWindow, XSync)
+    from gamma.context_xrandr import RROutput, Xrandr, XRandRContext
+except (ImportError, OSError, AttributeError):
+    XRandRContext = None
+
+PropModeReplace = 0
+
+
+def dimmed(size, calibration=None):
+    return generate_ramp(size=size, gamma=2.2, contrast=0.5,
+                         out=(c_ushort * size * 3)(),
+                         calibration=calibration)
+
+
+def values(ramp):
+    return memoryview(ramp).cast('B').cast('H')
+
+
+# Runs against a private Xvfb server; skipped where Xvfb or libXrandr is
+# missing, or where the server has no CRTC with a gamma ramp.
+@unittest.skipIf(XRandRContext is None, 'libXrandr is not available')
+@unittest.skipIf(shutil.which('Xvfb') is None, 'Xvfb is not installed')
+class XvfbTestCase(unittest.TestCase):
+
+    xvfb_args = ()
+
+    @classmethod
+    def setUpClass(cls):
+        # Xvfb picks a free display and writes its number to displayfd
+        # once it accepts connections
+        read_fd, write_fd = os.pipe()
+
+        try:
+            cls.xvfb = subprocess.Popen(
+                ['Xvfb', '-displayfd', str(write_fd), '-nolisten', 'tcp',
+                 '-screen', '0', '640x480x24', *cls.xvfb_args],
+                pass_fds=(write_fd,), stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+        finally:
+            os.close(write_fd)
+
+        with os.fdopen(read_fd) as f:
+            display = f.readline().strip()
+
+        if not display:
+            cls.xvfb.wait()
+            raise unittest.SkipTest('Xvfb failed to start')
+
+        cls.environ = mock.patch.dict(os.environ,
+                                      {'DISPLAY': ':' + display})
+        cls.environ.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.environ.stop()
+        cls.xvfb.terminate()
+        cls.xvfb.wait()
+
+    def open(self, **kwargs):
+        try:
+            return XRandRContext(**kwargs)
+        except ContextError as e:
+            self.skipTest(str(e))
+
+
+class XRandRContextTest(XvfbTestCase):
+
+    def dimmed(self, size):
+        return dimmed(size)
+
+    def test_set_ramp(self):
+        with self.open() as context:
+            ramp = self.dimmed(context.ramp_size)
+
+            context.set_ramp(ramp)
+            self.assertEqual(bytes(context.get_ramp()), bytes(ramp))
+
+            context.set_ramp(ramp)
+            self.assertEqual(context.submissions, 1)
+            self.assertEqual(context.skipped_submissions, 1)
+
+    def test_close_restores_snapshot(self):
+        with self.open() as context:
+            snapshot = bytes(context.get_ramp())
+            context.set_ramp(self.dimmed(context.ramp_size))
+
+        self.assertTrue(context.snapshot_restored)
+
+        with self.open() as context:
+            self.assertEqual(bytes(context.get_ramp()), snapshot)
+
+
+# Two CRTCs, each with its own _ICC_PROFILE output property, and the root
+# window's _ICC_PROFILE, which belongs to the primary CRTC only.
+class XRandRCalibrationTest(XvfbTestCase):
+
+    xvfb_args = ('-crtcs', '2')
+
+    PRIMARY = vcgt_table(gamma=(0.9, 1.0, 1.1))
+    SECONDARY = vcgt_table(gamma=(1.2, 1.1, 1.0))
+
+    def setUp(self):
+        display = XOpenDisplay(None)
+
+        if not display:
+            self.skipTest('XOpenDisplay failed')
+
+        self.display = display
+        self.root = XRootWindow(display, XDefaultScreen(display))
+        self.atom = XInternAtom(display, b'_ICC_PROFILE', False)
+        self.outputs = []
+
+    def tearDown(self):
+        X11.XDeleteProperty(self.display, self.root, self.atom)
+
+        for output in self.outputs:
+            Xrandr.XRRDeleteOutputProperty(self.display, RROutput(output),
+                                           self.atom)
+
+        XSync(self.display, False)
+        XCloseDisplay(self.display)
+
+    def set_profiles(self, context, secondary=True):
+        primary = context._primary_crtc
+        other = next(crtc for crtc, size in context.crtcs if crtc != primary)
+        output = context._outputs[other][0]
+        self.outputs.append(output)
+
+        X11.XChangeProperty(self.display, self.root, self.atom,
+                            XAtom(XA_CARDINAL), 8, PropModeReplace,
+                            (c_ubyte * len(self.PRIMARY))(*self.PRIMARY),
+                            c_int(len(self.PRIMARY)))
+
+        if secondary:
+            Xrandr.XRRChangeOutputProperty(
+                self.display, RROutput(output), self.atom,
+                XAtom(XA_CARDINAL), 8, PropModeReplace,
+                (c_ubyte * len(self.SECONDARY))(*self.SECONDARY),
+                c_int(len(self.SECONDARY)))
+
+        XSync(self.display, False)
+
+        # the watch thread flags the change once the events arrive
+        deadline = time.monotonic() + 5
+
+        while not context._calibration_stale:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+        return primary, other
+
+    def open(self, **kwargs):
+        context = super().open(**kwargs)
+
+        if len(context.crtcs) < 2:
+            context.close()
+            self.skipTest('Xvfb has fewer than two active CRTCs')
+
+        return context
+
+    def expected(self, data, size, ramp):
+        if data is None:
+            return ramp(size)
+
+        return ramp(size, Calibration(read_icc_ramp(data, size=size)))
+
+    def assertRamps(self, context, profiles, ramp):
+        for crtc, size in context.crtcs:
+            expected = self.expected(profiles[crtc], size, ramp)
+            actual = context._get_crtc_ramp(crtc, size)
+
+            with self.subTest(crtc=crtc):
+                self.assertLessEqual(max(abs(x - y) for x, y in
+                                         zip(values(expected), actual)), 3)
+
+    def test_each_crtc_gets_its_profile(self):
+        with self.open() as context:
+            primary, other = self.set_profiles(context)
+            context.set_ramp(dimmed(context.ramp_size))
+
+            self.assertRamps(context, {primary: self.PRIMARY,
+                                       other: self.SECONDARY}, dimmed)
+
+    def test_root_profile_is_only_the_primary(self):
+        with self.open() as context:
+            primary, other = self.set_profiles(context, secondary=False)
+            context.set_ramp(dimmed(context.ramp_size))
+
+            self.assertRamps(context, {primary: self.PRIMARY, other: None},
+                             dimmed)
+
+    def test_close_restores_each_profile(self):
+        def identity(size, calibration=None):
+            return generate_ramp(size=size, out=(c_ushort * size * 3)(),
+                                 calibration=calibration)
+
+        context = self.open(use_snapshot=False)
+
+        with context:
+            primary, other = self.set_profiles(context)
+            context.set_ramp(dimmed(context.ramp_size))
+
+        self.assertFalse(context.snapshot_restored)
+
+        with self.open() as reopened:
+            self.assertRamps(reopened, {primary: self.PRIMARY,
+                                        other: self.SECONDARY}, identity)
+
+
+if __name__ == '__main__':
+    unittest.main()
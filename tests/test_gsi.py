@@ -0,0 +1,145 @@
+import json
+import random
+import unittest
+
+from gsi import parse_state, select_state
+
+
+# Strings that would confuse a scanner looking for quotes, braces, commas
+# or member names.
+TRICKY = ['', 'plain', 'a"b', '}', '{', '"}, "round": {"phase": "x"', '\\',
+          '\\"', '\n\t"player": ', 'café', '☃ \U0001f600', '\t',
+          ', "flashed": 255', '/*', '\x00\x1f']
+
+
+def state(rng):
+    value = rng.choice
+    data = {}
+
+    if rng.random() < 0.9:
+        data['provider'] = {'name': 'Counter-Strike: Global Offensive',
+                            'appid': 730, 'version': 13694,
+                            'steamid': value(['76561198000000000',
+                                              value(TRICKY)]),
+                            'timestamp': rng.randrange(1500000000,
+                                                       1600000000)}
+
+    if rng.random() < 0.5:
+        data['map'] = {'mode': 'competitive', 'name': value(TRICKY),
+                       'phase': 'live', 'round': rng.randrange(30),
+                       'team_ct': {'score': 3, 'name': value(TRICKY)}}
+
+    if rng.random() < 0.9:
+        data['round'] = {'phase': value(['live', 'over', 'freezetime',
+                                         value(TRICKY)])}
+
+    if rng.random() < 0.9:
+        player = {'steamid': value(['76561198000000000',
+                                    '76561198000000001']),
+                  'name': value(TRICKY), 'team': 'CT',
+                  'activity': 'playing'}
+
+        if rng.random() < 0.9:
+            player['state'] = {'health': 100, 'armor': 0, 'helmet': False,
+                               'flashed': rng.randrange(256),
+                               'smoked': rng.randrange(256),
+                               'burning': 0, 'money': 800}
+
+            if rng.random() < 0.1:
+                del player['state'][value(['flashed', 'smoked'])]
+
+        if rng.random() < 0.5:
+            player['weapons'] = {'weapon_{}'.format(i): {
+                'name': value(TRICKY), 'paintkit': 'default',
+                'state': 'holstered'} for i in range(rng.randrange(4))}
+
+        data['player'] = player
+
+    if rng.random() < 0.3:
+        data['allplayers'] = {str(76561198000000000 + i): {
+            'name': value(TRICKY), 'steamid': str(i),
+            'state': {'flashed': rng.randrange(256), 'smoked': 0}}
+            for i in range(rng.randrange(1, 4))}
+
+    # previously and added repeat member names one level deeper
+    if rng.random() < 0.5:
+        data['previously'] = {'player': {'state': {
+            'flashed': rng.randrange(256)}}, 'round': {'phase': 'over'}}
+
+    if rng.random() < 0.3:
+        data['added'] = {'player': {'weapons': {'weapon_2': True}}}
+
+    if rng.random() < 0.2:
+        data['auth'] = {'token': value(TRICKY)}
+
+    keys = list(data)
+    rng.shuffle(keys)
+
+    return {key: data[key] for key in keys}
+
+
+def dump(data, newline='\n', **kwargs):
+    text = json.dumps(data, indent='\t', **kwargs)
+    return text.replace('\n', newline).encode('utf-8')
+
+
+class SelectStateTest(unittest.TestCase):
+
+    def assertSelects(self, body):
+        self.assertEqual(select_state(body),
+                         parse_state(json.loads(body.decode('utf-8'))))
+
+    def test_random_payloads(self):
+        rng = random.Random(0)
+
+        for i in range(2000):
+            data = state(rng)
+
+            for newline in ('\n', '\r\n'):
+                for ensure_ascii in (True, False):
+                    body = dump(data, newline, ensure_ascii=ensure_ascii)
+
+                    with self.subTest(i=i, newline=newline,
+                                      ensure_ascii=ensure_ascii):
+                        self.assertSelects(body)
+
+    def test_tricky_strings(self):
+        for text in TRICKY:
+            data = {'provider': {'steamid': text, 'timestamp': 1},
+                    'round': {'phase': text},
+                    'player': {'name': text, 'steamid': text,
+                               'state': {'flashed': 7, 'smoked': 3}},
+                    'previously': {'player': {'steamid': text}}}
+
+            with self.subTest(text=text):
+                self.assertSelects(dump(data))
+                self.assertSelects(dump(data, '\r\n', ensure_ascii=False))
+
+    def test_empty_and_missing_members(self):
+        for data in ({}, {'provider': {}}, {'player': {'state': {}}},
+                     {'player': {'state': None}},
+                     {'round': {'phase': None}}):
+            body = dump(data)
+
+            with self.subTest(data=data):
+                if body.startswith(b'{\n'):
+                    self.assertSelects(body)
+                else:
+                    self.assertIsNone(select_state(body))
+
+    def test_other_layouts(self):
+        data = state(random.Random(1))
+
+        for body in (json.dumps(data).encode('utf-8'),
+                     json.dumps(data, separators=(',', ':')).encode(),
+                     json.dumps(data, indent=2).encode(),
+                     json.dumps(data, indent=4).encode(),
+                     json.dumps(data, indent='\t',
+                                separators=(',', ':')).encode(),
+                     b' ' + dump(data), b''):
+            with self.subTest(body=body[:40]):
+                self.assertIsNone(select_state(body))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import itertools
+import random
+import unittest
+from contextlib import contextmanager
+from ctypes import c_ushort
+from unittest import mock
+
+from gamma import Calibration, generate_ramp
+from gamma import ramp as ramp_module
+from gamma.ramp import _generate_ramp_python, pack_ramp, to_whitepoint
+
+
+SIZES = (2, 256, 1024, 4096)
+
+PARAMETERS = [dict(gamma=gamma, contrast=contrast, brightness=brightness,
+                   temperature=temperature, minimum=minimum, maximum=maximum)
+              for gamma, contrast, brightness, temperature, (minimum,
+                                                             maximum)
+              in itertools.product((0.5, 1.0, 2.2), (0.1, 0.6, 1.0),
+                                   (0.0, 0.05), (1000, 5500, 6500,
+                                                 (1.0, 0.9, 0.8)),
+                                   ((0.0, 1.0), (16 / 255, 235 / 255)))]
+
+
+# base_curve caches NumPy arrays or tuples depending on which path filled
+# it, so it is cleared around every switch.
+@contextmanager
+def without_numpy():
+    ramp_module.base_curve.cache_clear()
+
+    try:
+        with mock.patch.object(ramp_module, 'np', None):
+            yield
+    finally:
+        ramp_module.base_curve.cache_clear()
+
+
+def packed(size, **kwargs):
+    return generate_ramp(size=size, out=(c_ushort * size * 3)(), **kwargs)
+
+
+def values(ramp):
+    view = memoryview(ramp)
+    return view.cast('B').cast('f' if view.format == 'f' else 'H')
+
+
+@unittest.skipIf(ramp_module.np is None, 'NumPy is not installed')
+class NumPyParityTest(unittest.TestCase):
+
+    def assertParity(self, make, tolerance):
+        for size, parameters in itertools.product(SIZES, PARAMETERS):
+            expected = values(make(size, **parameters))
+
+            with without_numpy():
+                actual = values(make(size, **parameters))
+
+            with self.subTest(size=size, **parameters):
+                self.assertLessEqual(max(abs(x - y) for x, y in
+                                         zip(expected, actual)), tolerance)
+
+    def test_float(self):
+        self.assertParity(lambda size, **kwargs: generate_ramp(
+            size=size, typecode='f', **kwargs), 1e-6)
+
+    def test_packed(self):
+        self.assertParity(packed, 1)
+
+    def test_calibration(self):
+        calibration_ramp = generate_ramp(size=256, gamma=(1.1, 1.0, 0.9),
+                                         contrast=0.95)
+
+        def make(size, **kwargs):
+            return generate_ramp(size=size, typecode='f',
+                                 calibration=Calibration(calibration_ramp),
+                                 **kwargs)
+
+        self.assertParity(make, 1e-6)
+
+
+class ComposeTest(unittest.TestCase):
+
+    # Composing a packed ramp after the fact quantizes it first. The
+    # steepest segment of the calibration, at the foot of the 0.9 curve
+    # with a slope of about 2.3, stretches that to 2 LSB on top of the
+    # truncation.
+    def assertComposes(self, typecode, tolerance):
+        for size, parameters in itertools.product(SIZES, PARAMETERS[::7]):
+            calibration = Calibration(generate_ramp(
+                size=size, gamma=(1.1, 1.0, 0.9), contrast=0.95))
+
+            if typecode == 'H':
+                expected = packed(size, calibration=calibration,
+                                  **parameters)
+                actual = calibration.compose(packed(size, **parameters))
+            else:
+                expected = generate_ramp(size=size, calibration=calibration,
+                                         **parameters)
+                actual = calibration.compose(generate_ramp(size=size,
+                                                           **parameters))
+
+            with self.subTest(size=size, **parameters):
+                self.assertLessEqual(max(abs(x - y) for x, y in
+                                         zip(values(expected),
+                                             values(actual))), tolerance)
+
+    def test_float(self):
+        self.assertComposes('f', 1e-6)
+
+        with without_numpy():
+            self.assertComposes('f', 1e-6)
+
+    def test_packed(self):
+        self.assertComposes('H', 3)
+
+        with without_numpy():
+            self.assertComposes('H', 3)
+
+
+class FixedPointTest(unittest.TestCase):
+
+    # The fixed-point path may differ from int(65535 * y) on the float path
+    # by 1 LSB where 65535 * y is within rounding error of an integer.
+    def test_within_one_lsb(self):
+        rng = random.Random(0)
+
+        for _ in range(200):
+            size = rng.choice(SIZES)
+            gamma = rng.uniform(0.3, 3.0)
+            brightness = rng.uniform(0.0, 0.2)
+            contrast = rng.uniform(0.0, 1.0)
+            temperature = rng.randrange(1000, 25001)
+            minimum = rng.uniform(0.0, 0.2)
+            maximum = rng.uniform(0.8, 1.0)
+
+            with without_numpy():
+                actual = values(packed(size, gamma=gamma,
+                                       brightness=brightness,
+                                       contrast=contrast,
+                                       temperature=temperature,
+                                       minimum=minimum, maximum=maximum))
+                expected = values(pack_ramp(_generate_ramp_python(
+                    size, (gamma,) * 3, (brightness,) * 3, (contrast,) * 3,
+                    to_whitepoint(temperature), (minimum,) * 3,
+                    (maximum,) * 3), (c_ushort * size * 3)()))
+
+            with self.subTest(size=size, gamma=gamma, brightness=brightness,
+                              contrast=contrast, temperature=temperature,
+                              minimum=minimum, maximum=maximum):
+                self.assertLessEqual(max(abs(x - y) for x, y in
+                                         zip(expected, actual)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()